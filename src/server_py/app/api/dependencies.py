@@ -1,24 +1,73 @@
-from fastapi import Depends, HTTPException, status, Security
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import hashlib
+import time
+import uuid
+from datetime import datetime, timezone
+from cachetools import TTLCache
+from fastapi import Depends, HTTPException, Request, status, Security
+from fastapi.security import HTTPBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from app.db.database import get_db
 from app.core.config import settings
 from app.core.security import decode_token
-from app.models.models import User
-from typing import Optional
+from app.models.models import User, Role
+from typing import FrozenSet, NamedTuple, Optional
+
+class StateBearer(HTTPBearer):
+    """
+    HTTP Bearer security scheme that reads the token already extracted by
+    BearerTokenMiddleware instead of re-parsing the Authorization header.
+    Keeps the BearerAuth scheme in the OpenAPI docs.
+    """
+    async def __call__(self, request: Request) -> Optional[str]:
+        return getattr(request.state, "bearer_token", None)
 
 # HTTP Bearer security scheme
-security = HTTPBearer(
+security = StateBearer(
     scheme_name="BearerAuth",
     description="JWT Authorization header using Bearer scheme",
-    auto_error=True,
+    auto_error=False,
 )
 
+class CachedPrincipal(NamedTuple):
+    """Plain snapshot of an authenticated user, safe to share across sessions"""
+    user_id: uuid.UUID
+    username: str
+    is_active: bool
+    locked_until: Optional[datetime]
+    role_names: FrozenSet[str]
+    token_exp: Optional[float]
+
+# Built once at import; SQLAlchemy's compiled cache then reuses the SQL for every lookup
+_user_by_username_stmt = (
+    select(User)
+    .options(selectinload(User.roles))
+    .where(User.username == bindparam("username"))
+)
+
+# Validated tokens -> principal, so hot users skip JWT decoding and the user lookup
+_principal_cache: TTLCache = TTLCache(maxsize=10_000, ttl=settings.AUTH_CACHE_TTL_SECONDS)
+
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def _principal_to_user(principal: CachedPrincipal) -> User:
+    """Rebuild a detached User carrying the fields used by the routes"""
+    user = User(
+        id=principal.user_id,
+        username=principal.username,
+        is_active=principal.is_active,
+        locked_until=principal.locked_until,
+    )
+    user.roles = [Role(name=name) for name in principal.role_names]
+    return user
+
 # Updated function to use new security scheme
-def get_current_user(
-    db: Session = Depends(get_db),
-    credentials: HTTPAuthorizationCredentials = Security(security)
+async def get_current_user(
+    db: AsyncSession = Depends(get_db),
+    token: Optional[str] = Security(security)
 ) -> User:
     """
     Get the current authenticated user from the JWT token
@@ -29,37 +78,61 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        token = credentials.credentials
-        payload = decode_token(token)
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except (JWTError, Exception):
+    if not token:
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise credentials_exception
+    cache_key = _token_cache_key(token)
+    principal = _principal_cache.get(cache_key)
+    
+    # Never serve a cached principal past the token's own expiry
+    if principal is not None and principal.token_exp is not None and principal.token_exp <= time.time():
+        _principal_cache.pop(cache_key, None)
+        principal = None
+    
+    if principal is not None:
+        user = _principal_to_user(principal)
+    else:
+        try:
+            payload = decode_token(token)
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+        except (JWTError, Exception):
+            raise credentials_exception
+        
+        # Load roles in the same round-trip so role checks don't lazy-load per request
+        result = await db.execute(_user_by_username_stmt, {"username": username})
+        user = result.scalars().first()
+        if user is None:
+            raise credentials_exception
+        
+        principal = CachedPrincipal(
+            user_id=user.id,
+            username=user.username,
+            is_active=user.is_active,
+            locked_until=user.locked_until,
+            role_names=frozenset(role.name for role in user.roles),
+            token_exp=payload.get("exp"),
+        )
+        _principal_cache[cache_key] = principal
     
     # Check if user is active
-    if not user.is_active:
+    if not principal.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Account is deactivated",
         )
     
     # Check if user is locked
-    from datetime import datetime
-    if user.locked_until and user.locked_until > datetime.utcnow():
+    if principal.locked_until and principal.locked_until > datetime.now(timezone.utc):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"Account is temporarily locked until {user.locked_until}",
+            detail=f"Account is temporarily locked until {principal.locked_until}",
         )
     
     return user
 
-def get_current_active_user(
+async def get_current_active_user(
     current_user: User = Depends(get_current_user),
 ) -> User:
     """
@@ -67,7 +140,7 @@ def get_current_active_user(
     """
     return current_user
 
-def check_admin_role(
+async def check_admin_role(
     current_user: User = Depends(get_current_user),
 ) -> User:
     """
@@ -0,0 +1,19 @@
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+class BearerTokenMiddleware:
+    """
+    Pure ASGI middleware that extracts the bearer token from the Authorization
+    header once per request and stores it in the request state as `bearer_token`
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    if value[:7].lower() == b"bearer ":
+                        scope.setdefault("state", {})["bearer_token"] = value[7:].strip().decode("latin-1")
+                    break
+        
+        await self.app(scope, receive, send)
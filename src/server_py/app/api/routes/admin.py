@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 import uuid
 
@@ -17,36 +17,36 @@ router = APIRouter(
 )
 
 @router.get("/users", response_model=List[UserAdminResponse])
-def list_users(
-    search: Optional[str] = Query(None, description="Search term for username, email, first name, or last name"),
+async def list_users(
+    search: Optional[str] = Query(None, description="Search term for username, email, first name, or last name (3+ characters to use the search indexes)"),
     is_active: Optional[bool] = Query(None, description="Filter by active status"),
     skip: int = Query(0, ge=0, description="Number of users to skip"),
     limit: int = Query(20, ge=1, le=100, description="Max number of users to return"),
     current_user: User = Depends(check_admin_role),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     List all users with optional filters (admin only)
     """
-    return AdminUserService.find_all_users(db, search, is_active, skip, limit)
+    return await AdminUserService.find_all_users(db, search, is_active, skip, limit)
 
 @router.get("/users/{user_id}", response_model=UserAdminResponse)
-def get_user_details(
+async def get_user_details(
     user_id: uuid.UUID = Path(..., description="The ID of the user to get details for"),
     current_user: User = Depends(check_admin_role),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get detailed information about a specific user (admin only)
     """
-    return AdminUserService.get_user_details(db, user_id)
+    return await AdminUserService.get_user_details(db, user_id)
 
 @router.put("/users/{user_id}/status", response_model=MessageResponse)
-def update_user_status(
+async def update_user_status(
     update_data: UserStatusUpdateRequest,
     user_id: uuid.UUID = Path(..., description="The ID of the user to update"),
     current_user: User = Depends(check_admin_role),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Update a user's active status and/or lock status (admin only)
@@ -58,31 +58,31 @@ def update_user_status(
             detail="Cannot deactivate your own account"
         )
     
-    return AdminUserService.update_user_status(db, user_id, update_data)
+    return await AdminUserService.update_user_status(db, user_id, update_data)
 
 @router.post("/tokens/purge-expired", response_model=MessageResponse)
-def purge_expired_tokens(
+async def purge_expired_tokens(
     current_user: User = Depends(check_admin_role),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Purge all expired refresh tokens from the database (admin only)
     """
-    count = AdminTokenService.purge_expired_tokens(db)
+    count = await AdminTokenService.purge_expired_tokens(db)
     return MessageResponse(
         message=f"Successfully purged {count} expired refresh tokens",
         success=True
     )
 
 @router.get("/users/count")
-def count_users(
-    search: Optional[str] = Query(None, description="Search term for username, email, first name, or last name"),
+async def count_users(
+    search: Optional[str] = Query(None, description="Search term for username, email, first name, or last name (3+ characters to use the search indexes)"),
     is_active: Optional[bool] = Query(None, description="Filter by active status"),
     current_user: User = Depends(check_admin_role),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Count total users with optional filters (admin only)
     """
-    total = AdminUserService.count_total_users(db, search, is_active)
+    total = await AdminUserService.count_total_users(db, search, is_active)
     return {"total": total}
\ No newline at end of file
@@ -1,15 +1,60 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+import logging
 import uuid
 
-from app.db.database import get_db
+from app.db.database import AsyncSessionLocal, get_db
 from app.api.dependencies import get_current_active_user
 from app.models.models import User, Chat, Message
-from app.services.chat_service import ChatService
+from app.services.chat_service import ChatService, MESSAGE_RESPONSE_COLUMNS
 from app.schemas.chat import ChatRequest, MessageRequest, ChatResponse, ChatMessageResponse
 from app.schemas.base import MessageResponse
 
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round-trip when streaming chat messages
+MESSAGE_STREAM_BATCH_SIZE = 200
+
+# Chat list is always sorted by last update, so this part of the page envelope never changes
+_CHAT_PAGE_SORT = {"empty": False, "sorted": True, "unsorted": False}
+
+async def _open_message_stream(request_db: AsyncSession, query):
+    """
+    Run a MESSAGE_RESPONSE_COLUMNS query as a server-side cursor on a session of its own, since the
+    response outlives the request handler. The request session is closed first so a streaming
+    response holds only one pooled connection. Returns (session, batches, first batch or None);
+    the session is closed here if there are no rows.
+    """
+    await request_db.close()
+    stream_db = AsyncSessionLocal()
+    try:
+        result = await stream_db.stream(query.execution_options(yield_per=MESSAGE_STREAM_BATCH_SIZE))
+        batches = result.partitions()
+        first_batch = await anext(batches, None)
+    except Exception:
+        await stream_db.close()
+        raise
+    
+    if first_batch is None:
+        await stream_db.close()
+    return stream_db, batches, first_batch
+
+async def _stream_message_array(stream_db, batches, first_batch):
+    """Yield messages batch by batch as the items of a JSON array, then close the session"""
+    try:
+        separator = b""
+        batch = first_batch
+        while batch is not None:
+            for msg in batch:
+                yield separator + ChatService.dumps(ChatService.message_to_dict(msg))
+                separator = b","
+            batch = await anext(batches, None)
+    finally:
+        await stream_db.close()
+
 router = APIRouter(
     prefix="/chats",
     tags=["Chats"],
@@ -17,95 +62,120 @@ router = APIRouter(
 )
 
 @router.post("", response_model=ChatResponse)
-def create_chat(
+async def create_chat(
     chat_data: ChatRequest,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Create a new chat
     """
-    return ChatService.create_chat(db, current_user.id, chat_data)
+    return await ChatService.create_chat(db, current_user.id, chat_data)
 
-@router.get("", response_model=dict)
-def list_chats(
-    skip: int = Query(0, ge=0),
+@router.get("", response_class=ORJSONResponse)
+async def list_chats(
+    cursor: Optional[str] = Query(None, description="Cursor returned as nextCursor by the previous page"),
     limit: int = Query(20, ge=1, le=100),
+    include_total: bool = Query(False, description="Include totalElements (first page only)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    List all chats for the current user with pagination
-    Similar to Java Spring's Page structure
+    List all chats for the current user with cursor pagination
+    Similar to Java Spring's Slice structure
+    Chats come back as plain dicts, so the page is serialized as-is
     """
-    total_count = db.query(Chat).filter(Chat.user_id == current_user.id).count()
-    chats = ChatService.list_user_chats(db, current_user.id, skip, limit)
+    chats, next_cursor, total = await ChatService.list_user_chats(
+        db, current_user.id, cursor, limit, include_total
+    )
     
     # Return a paginated result structure similar to Spring Boot
-    return {
+    page = {
         "content": chats,
         "pageable": {
-            "pageNumber": skip // limit if limit > 0 else 0,
             "pageSize": limit,
-            "offset": skip
+            "cursor": cursor
         },
-        "totalElements": total_count,
-        "totalPages": (total_count + limit - 1) // limit if limit > 0 else 1,
-        "last": skip + limit >= total_count,
+        "nextCursor": next_cursor,
+        "last": next_cursor is None,
         "size": limit,
-        "number": skip // limit if limit > 0 else 0,
-        "sort": {
-            "empty": False,
-            "sorted": True,
-            "unsorted": False
-        },
+        "sort": _CHAT_PAGE_SORT,
         "numberOfElements": len(chats),
-        "first": skip == 0,
+        "first": cursor is None,
         "empty": len(chats) == 0
     }
+    if total is not None:
+        page["totalElements"] = total
+    
+    return Response(ChatService.dumps(page), media_type="application/json")
 
 @router.get("/{chat_id}", response_model=ChatResponse)
-def get_chat(
+async def get_chat(
     chat_id: uuid.UUID = Path(..., title="The ID of the chat to get"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get a specific chat by ID
+    Messages are streamed from a server-side cursor, so long chats are never
+    fully materialized in memory; response_model only documents the shape.
     """
-    return ChatService.get_chat(db, chat_id, current_user.id)
+    chat = await db.scalar(select(Chat).where(Chat.id == chat_id, Chat.user_id == current_user.id))
+    if not chat:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Chat not found with id: {chat_id}"
+        )
+    
+    # Chat fields first, then the messages array as the last key
+    chat_fields = ChatService.chat_to_dict(chat)
+    del chat_fields["messages"]
+    head = ChatService.dumps(chat_fields)[:-1] + b',"messages":['
+    
+    stream_db, batches, first_batch = await _open_message_stream(
+        db, select(*MESSAGE_RESPONSE_COLUMNS).where(Message.chat_id == chat_id).order_by(Message.created_at)
+    )
+    
+    async def generate_json():
+        yield head
+        if first_batch is not None:
+            async for chunk in _stream_message_array(stream_db, batches, first_batch):
+                yield chunk
+        yield b"]}"
+    
+    return StreamingResponse(generate_json(), media_type="application/json")
 
 @router.put("/{chat_id}", response_model=ChatResponse)
-def update_chat(
+async def update_chat(
     chat_data: ChatRequest,
     chat_id: uuid.UUID = Path(..., title="The ID of the chat to update"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Update a chat's title, description or model
     """
-    return ChatService.update_chat(db, chat_id, current_user.id, chat_data)
+    return await ChatService.update_chat(db, chat_id, current_user.id, chat_data)
 
 @router.delete("/{chat_id}", response_model=MessageResponse)
-def delete_chat(
+async def delete_chat(
     chat_id: uuid.UUID = Path(..., title="The ID of the chat to delete"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a chat
     """
-    result = ChatService.delete_chat(db, chat_id, current_user.id)
+    result = await ChatService.delete_chat(db, chat_id, current_user.id)
     return MessageResponse(message="Chat deleted successfully", success=result)
 
 @router.post("/{chat_id}/messages", response_model=ChatMessageResponse)
-def add_message(
+async def add_message(
     message_data: MessageRequest,
     chat_id: uuid.UUID = Path(..., title="The ID of the chat to add a message to"),
-    role: str = Query("user", description="Role of the message sender (user or assistant)"),
+    role: Literal["user", "assistant"] = Query("user", description="Role of the message sender (user or assistant)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Add a message to a chat
@@ -114,59 +184,60 @@ def add_message(
     It processes a message and adds it to the chat with the specified role.
     """
     # Validate that the chat exists and belongs to the user
-    chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == current_user.id).first()
-    if not chat:
+    chat_exists = await db.scalar(
+        select(exists().where(Chat.id == chat_id, Chat.user_id == current_user.id))
+    )
+    if not chat_exists:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Chat not found with id: {chat_id}"
         )
     
-    # Validate role
-    if role not in ["user", "assistant"]:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Role must be either 'user' or 'assistant'"
-        )
-    
     # Log the received message for debugging
-    print(f"Received message content: {message_data.content}, role: {role}")
+    logger.debug("Received message role=%s len=%d", role, len(message_data.content))
     
     # Add the message using the ChatService
-    return ChatService.add_message(db, chat_id, message_data, role)
+    return await ChatService.add_message(db, chat_id, message_data, role)
 
 @router.get("/{chat_id}/messages", response_model=List[ChatMessageResponse])
-def get_chat_messages(
+async def get_chat_messages(
     chat_id: uuid.UUID = Path(..., title="The ID of the chat to get messages for"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get all messages in a specific chat
     
     This endpoint is similar to getChatMessages in Java's ChatController.
     It retrieves all messages from a chat that belongs to the user.
+    Messages are streamed from a server-side cursor as a JSON array,
+    so long chats are never fully materialized in memory.
     """
-    # Verify chat exists and belongs to the user
-    chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == current_user.id).first()
-    if not chat:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Chat not found with id: {chat_id}"
-        )
+    # Get all messages from this chat, joined on the owner so one query checks ownership too
+    query = (
+        select(*MESSAGE_RESPONSE_COLUMNS)
+        .join(Chat, Chat.id == Message.chat_id)
+        .where(Chat.id == chat_id, Chat.user_id == current_user.id)
+        .order_by(Message.created_at)
+    )
+    stream_db, batches, first_batch = await _open_message_stream(db, query)
     
-    # Get all messages from this chat
-    messages = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.created_at).all()
+    # No rows is either an empty chat or a chat the user doesn't own
+    if first_batch is None:
+        chat_exists = await db.scalar(
+            select(exists().where(Chat.id == chat_id, Chat.user_id == current_user.id))
+        )
+        if not chat_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Chat not found with id: {chat_id}"
+            )
+        return []
     
-    # Convert messages to response objects
-    message_responses = [
-        ChatMessageResponse(
-            id=msg.id,
-            role=msg.role,
-            content=msg.content,
-            model=msg.model,
-            tokens=msg.tokens,
-            created_at=msg.created_at
-        ) for msg in messages
-    ]
+    async def generate_json():
+        yield b"["
+        async for chunk in _stream_message_array(stream_db, batches, first_batch):
+            yield chunk
+        yield b"]"
     
-    return message_responses
\ No newline at end of file
+    return StreamingResponse(generate_json(), media_type="application/json")
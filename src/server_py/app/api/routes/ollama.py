@@ -1,32 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
-from fastapi.responses import StreamingResponse, JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
+from sqlalchemy import select, exists
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Dict, Any
 import uuid
-import json
-from datetime import datetime
+import logging
+import orjson
 
-from app.db.database import get_db
+from app.db.database import AsyncSessionLocal, get_db
 from app.api.dependencies import get_current_active_user, check_admin_role
-from app.models.models import User
+from app.models.models import User, Chat
 from app.services.ollama_service import OllamaService
 from app.services.chat_service import ChatService
-from app.schemas.chat import OllamaModelInfo, OllamaChatCompletionRequest, OllamaModelCopyRequest, MessageRequest, OllamaAvailableModelsResponse
+from app.schemas.chat import OllamaModelInfo, OllamaChatCompletionRequest, OllamaModelCopyRequest, OllamaAvailableModelsResponse
 from app.schemas.base import MessageResponse
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     prefix="/ollama",
     tags=["Ollama"],
     responses={404: {"description": "Not found"}},
 )
 
-# Custom JSON encoder that handles datetime objects
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
-
 # Định nghĩa class ChatRequest để tương thích với server Java
 class ChatRequest:
     def __init__(self, model: str, messages: List[Dict[str, str]], streaming: bool = False, options: Dict[str, Any] = None):
@@ -62,17 +58,8 @@ async def get_available_models(
     # Get models in the same format as Java API
     response = await OllamaService.get_available_models_formatted()
     
-    # Convert models to dictionary and handle datetime serialization
-    model_list = []
-    for model in response.models:
-        model_dict = model.dict()
-        # Ensure datetime is converted to string
-        if model_dict.get('modified') is not None:
-            model_dict['modified'] = model_dict['modified'].isoformat() if isinstance(model_dict['modified'], datetime) else model_dict['modified']
-        model_list.append(model_dict)
-    
-    # Return as raw JSON with custom handling for datetime objects
-    return JSONResponse(content={"models": model_list})
+    # JSON-mode dump already renders datetimes as ISO strings, so orjson serializes it in one pass
+    return ORJSONResponse(content=response.model_dump(mode="json"))
 
 @router.post("/models/pull", response_model=MessageResponse)
 async def pull_model(
@@ -147,7 +134,7 @@ async def generate_completion(
             )
         
         # Call Ollama service for non-streaming completion
-        full_response = ""
+        chunks = []
         async for content_chunk in OllamaService.chat_completion(
             OllamaChatCompletionRequest(
                 model=model,
@@ -156,7 +143,8 @@ async def generate_completion(
                 **options
             )
         ):
-            full_response += content_chunk
+            chunks.append(content_chunk)
+        full_response = "".join(chunks)
         
         # Return response in the same format as Java server
         return {
@@ -169,7 +157,7 @@ async def generate_completion(
         }
     except Exception as e:
         # Log error and return error response
-        print(f"Error generating completion: {str(e)}")
+        logger.error("Error generating completion: %s", e)
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content={
@@ -206,7 +194,13 @@ async def stream_completion(
                 detail="Model and messages are required fields"
             )
         
-        print(f"Streaming request with model: {model}, streaming: {streaming}, options: {options}")
+        logger.debug("Streaming request with model=%s streaming=%s", model, streaming)
+        
+        # Only the content changes between chunks, so the rest of the
+        # Server-Sent Event frame (same shape as the Java response) is built once:
+        # {"model": ..., "message": {"content": ..., "role": "assistant"}, "done": false}
+        frame_prefix = b'data: {"model":' + orjson.dumps(model) + b',"message":{"content":'
+        frame_suffix = b',"role":"assistant"},"done":false}\n\n'
         
         # Define the streaming response generator
         async def generate_stream():
@@ -219,24 +213,18 @@ async def stream_completion(
                         **options
                     )
                 ):
-                    # Format each chunk as a Server-Sent Event, similar to Java response
-                    response_data = {
-                        "model": model,
-                        "message": {"content": content_chunk, "role": "assistant"},
-                        "done": False
-                    }
-                    yield f"data: {json.dumps(response_data)}\n\n"
+                    yield frame_prefix + orjson.dumps(content_chunk) + frame_suffix
                 
                 # Send final 'done' event
-                yield f"data: {json.dumps({'done': True})}\n\n"
+                yield b"data: " + orjson.dumps({"done": True}) + b"\n\n"
             except Exception as e:
                 # Send error event
-                print(f"Error in streaming: {str(e)}")
+                logger.error("Error in streaming: %s", e)
                 error_data = {
                     "error": str(e) if str(e) else "Unknown error",
                     "done": True
                 }
-                yield f"data: {json.dumps(error_data)}\n\n"
+                yield b"data: " + orjson.dumps(error_data) + b"\n\n"
         
         # Return StreamingResponse
         return StreamingResponse(
@@ -245,7 +233,7 @@ async def stream_completion(
         )
     except Exception as e:
         # Log error for initial setup errors
-        print(f"Error setting up stream: {str(e)}")
+        logger.error("Error setting up stream: %s", e)
         
         # Define error stream
         async def error_stream():
@@ -253,7 +241,7 @@ async def stream_completion(
                 "error": "Failed to initialize streaming",
                 "done": True
             }
-            yield f"data: {json.dumps(error_data)}\n\n"
+            yield b"data: " + orjson.dumps(error_data) + b"\n\n"
         
         # Return error as stream
         return StreamingResponse(
@@ -266,26 +254,38 @@ async def chat_completion(
     chat_id: uuid.UUID,
     request: OllamaChatCompletionRequest,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Generate a streaming chat completion from Ollama and add it to the chat
     """
-    # Verify chat exists and belongs to user
-    chat_response = ChatService.get_chat(db, chat_id, current_user.id)
+    # Verify chat exists and belongs to user; only ownership matters, so skip loading messages
+    chat_exists = await db.scalar(
+        select(exists().where(Chat.id == chat_id, Chat.user_id == current_user.id))
+    )
+    if not chat_exists:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Chat not found with id: {chat_id}"
+        )
     
     async def generate_stream():
-        full_content = ""
+        chunks = []
         async for content_chunk in OllamaService.chat_completion(request):
-            full_content += content_chunk
-            yield f"data: {json.dumps({'content': content_chunk})}\n\n"
+            chunks.append(content_chunk)
+            yield b"data: " + orjson.dumps({"content": content_chunk}) + b"\n\n"
+        full_content = "".join(chunks)
         
-        # Save assistant message to database, sử dụng ChatService đã cải tiến
-        # để xử lý thông minh vai trò của tin nhắn
-        message_data = MessageRequest(content=full_content)
-        ChatService.add_message(db, chat_id, message_data, "assistant", request.model)
+        # Save assistant message to database; ownership was checked above.
+        # The stream outlives the request-scoped session, so use a fresh one
+        if full_content.strip():
+            async with AsyncSessionLocal() as stream_db:
+                message_id = await ChatService.save_assistant_message(
+                    stream_db, chat_id, full_content, request.model
+                )
+            logger.debug("Saved assistant message %s to chat %s", message_id, chat_id)
         
-        yield f"data: [DONE]\n\n"
+        yield b"data: [DONE]\n\n"
     
     return StreamingResponse(
         generate_stream(),
@@ -1,5 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from app.services.rag_processor import RAGProcessor
+import asyncio
+import logging
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from app.services.rag_processor import RAGProcessor, QueryEmbeddingBatcher
+from app.services.semantic_cache import SemanticCache
 from typing import Dict, List, Any, Optional
 import time
 from app.api.dependencies import get_current_active_user
@@ -7,10 +12,12 @@ from app.models.models import User
 from app.schemas.chat import RAGQuery, RAGResponse, RAGSourceItem, RAGBuildIndexResponse
 from app.services.rag_processor import (
     EMBEDDING_MODEL,
+    EMBEDDING_URL,
     LLM_MODEL,
-    FAISS_INDEX_PATH,
 )
 
+logger = logging.getLogger(__name__)
+
 # Khởi tạo router với prefix và tags
 router = APIRouter(
     prefix="/rag",
@@ -18,26 +25,36 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-# Initialize RAG processor
-rag_processor = None
+def get_rag_processor(request: Request) -> RAGProcessor:
+    """Dependency to get the RAG processor created in the app lifespan"""
+    return request.app.state.rag_processor
 
-def get_rag_processor() -> RAGProcessor:
-    """Dependency to get the RAG processor"""
-    global rag_processor
-    if rag_processor is None:
-        rag_processor = RAGProcessor()
-        
-        # Chỉ build vectorstore khi khởi tạo processor, 
-        # nhưng không load hoặc build index ở đây, chờ gọi API
-        if not hasattr(rag_processor, 'embeddings'):
-            rag_processor.initialize_embeddings()
-            
-    return rag_processor
+# Batches query embeddings across concurrent /rag/chat requests
+query_batcher = None
+
+def get_query_batcher(processor: RAGProcessor = Depends(get_rag_processor)) -> QueryEmbeddingBatcher:
+    """Dependency to get the shared query embedding batcher"""
+    global query_batcher
+    if query_batcher is None:
+        query_batcher = QueryEmbeddingBatcher(processor)
+    return query_batcher
+
+# Answers for near-duplicate queries
+semantic_cache = None
+
+def get_semantic_cache() -> SemanticCache:
+    """Dependency to get the semantic answer cache"""
+    global semantic_cache
+    if semantic_cache is None:
+        semantic_cache = SemanticCache()
+    return semantic_cache
 
 @router.post("/chat", response_model=RAGResponse)
 async def rag_chat(
     request: RAGQuery, 
     processor: RAGProcessor = Depends(get_rag_processor),
+    batcher: QueryEmbeddingBatcher = Depends(get_query_batcher),
+    cache: SemanticCache = Depends(get_semantic_cache),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -50,8 +67,20 @@ async def rag_chat(
         # Đo thời gian xử lý
         start_time = time.time()
         
-        # Gọi RAG processor để lấy câu trả lời và các nguồn
-        answer, sources = processor.generate_answer(request.query)
+        # Embedding được gom batch với các request đồng thời khác
+        query_embedding = await batcher.embed(request.query)
+        
+        # Câu hỏi gần giống câu đã trả lời thì dùng lại kết quả trong cache
+        cached = await asyncio.to_thread(cache.lookup, query_embedding)
+        if cached is not None:
+            answer, sources = cached
+        else:
+            # Gọi RAG processor để lấy câu trả lời và các nguồn (retrieval chạy ngoài event loop)
+            answer, sources = await processor.generate_answer(request.query, query_embedding)
+            
+            # Không cache câu trả lời lỗi (không có nguồn)
+            if sources:
+                await asyncio.to_thread(cache.add, query_embedding, answer, sources)
         
         # Tính thời gian xử lý
         query_time_ms = (time.time() - start_time) * 1000
@@ -80,9 +109,64 @@ async def rag_chat(
             detail=f"Error processing RAG query: {str(e)}"
         )
 
+@router.post("/chat/stream")
+async def rag_chat_stream(
+    request: RAGQuery,
+    processor: RAGProcessor = Depends(get_rag_processor),
+    batcher: QueryEmbeddingBatcher = Depends(get_query_batcher),
+    cache: SemanticCache = Depends(get_semantic_cache),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Process a RAG query and stream the answer as Server-Sent Events
+    
+    The first frame carries the sources, followed by one frame per answer token,
+    terminated by an `event: done` frame. /rag/chat remains for non-streaming clients.
+    """
+    try:
+        query_embedding = await batcher.embed(request.query)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
+            detail=f"Error processing RAG query: {str(e)}"
+        )
+    
+    cached = await asyncio.to_thread(cache.lookup, query_embedding)
+    
+    async def sse_iter():
+        if cached is not None:
+            answer, sources = cached
+            yield b"data: " + orjson.dumps({"sources": sources}) + b"\n\n"
+            yield b"data: " + orjson.dumps({"content": answer}) + b"\n\n"
+        else:
+            sources = []
+            tokens = []
+            try:
+                # Retrieval runs in a worker thread, tokens stream over the shared Ollama client
+                async for token, token_sources in processor.generate_answer_stream(request.query, query_embedding):
+                    if token_sources is not None:
+                        sources = token_sources
+                        yield b"data: " + orjson.dumps({"sources": sources}) + b"\n\n"
+                    else:
+                        tokens.append(token)
+                        yield b'data: {"content":' + orjson.dumps(token) + b"}\n\n"
+            except Exception as e:
+                logger.error(f"Error streaming RAG answer: {str(e)}")
+                yield b"event: error\ndata: " + orjson.dumps({"error": str(e)}) + b"\n\n"
+                return
+            
+            if sources:
+                await asyncio.to_thread(cache.add, query_embedding, "".join(tokens), sources)
+        
+        yield b"event: done\ndata: {}\n\n"
+    
+    return StreamingResponse(sse_iter(), media_type="text/event-stream")
+
 @router.post("/build-index", response_model=RAGBuildIndexResponse)
 async def build_vectorstore_index(
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(get_current_active_user),
+    processor: RAGProcessor = Depends(get_rag_processor),
+    cache: SemanticCache = Depends(get_semantic_cache)
 ):
     """
     Build or rebuild the vector database index for RAG
@@ -91,8 +175,6 @@ async def build_vectorstore_index(
     It will create embeddings for all text chunks and save them to disk for future use.
     """
     try:
-        processor = get_rag_processor()
-        
         # Đo thời gian xử lý
         start_time = time.time()
         
@@ -103,7 +185,7 @@ async def build_vectorstore_index(
         build_time_ms = (time.time() - start_time) * 1000
         
         # Get document count
-        document_count = len(processor.documents) if hasattr(processor, 'documents') and processor.documents else 0
+        document_count = processor.document_count
         
         # Check if the rebuild was successful
         if not success:
@@ -114,6 +196,9 @@ async def build_vectorstore_index(
                 document_count=document_count
             )
         
+        # Cached answers cite chunks from the old index
+        cache.clear()
+        
         # Trả về thông tin về việc xây dựng index
         return RAGBuildIndexResponse(
             success=True,
@@ -130,7 +215,8 @@ async def build_vectorstore_index(
 @router.get("/status", response_model=Dict[str, Any])
 async def get_index_status(
     current_user: User = Depends(get_current_active_user),
-    processor: RAGProcessor = Depends(get_rag_processor)
+    processor: RAGProcessor = Depends(get_rag_processor),
+    cache: SemanticCache = Depends(get_semantic_cache)
 ):
     """
     Get status of the RAG vectorstore
@@ -142,25 +228,19 @@ async def get_index_status(
         # Kiểm tra trạng thái của vectorstore
         vectorstore_loaded = processor.vectorstore is not None
         
-        # Lấy số lượng documents nếu có
-        document_count = 0
-        if hasattr(processor, 'documents') and processor.documents:
-            document_count = len(processor.documents)
-        elif vectorstore_loaded and hasattr(processor.vectorstore, '_dict'):
-            # Đây là cách LangChain FAISS lưu documents
-            document_count = len(processor.vectorstore._dict)
-        
         # Lấy thông tin về mô hình embedding
         embedding_model = EMBEDDING_MODEL  # Sử dụng biến từ rag_processor.py
         
-        # Kiểm tra xem index có được lưu trên đĩa không
-        import os
-        index_saved = os.path.exists(FAISS_INDEX_PATH)  # Sử dụng biến từ rag_processor.py
+        # Kiểm tra xem index có được lưu trên đĩa không (có cache ngắn hạn)
+        index_saved = processor.is_index_saved()
         
         return {
             "vectorstore_loaded": vectorstore_loaded,
-            "document_count": document_count,
+            "document_count": processor.document_count,
+            "quantization": processor.get_quantization_info(),
+            "semantic_cache": cache.stats(),
             "embedding_model": embedding_model,
+            "embedding_server": EMBEDDING_URL,
             "index_saved": index_saved,
             "status": "ready" if vectorstore_loaded else "not_loaded",
             "llm_model": LLM_MODEL  # Sử dụng biến từ rag_processor.py
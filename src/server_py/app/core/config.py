@@ -1,9 +1,13 @@
 import os
 import secrets
+from functools import lru_cache
 from typing import List, Optional, Union
-from pydantic import AnyHttpUrl, EmailStr, field_validator, validator
+from pydantic import AnyHttpUrl, EmailStr, Field, field_validator, model_validator, validator
 from pydantic_settings import BaseSettings
 
+_ENVIRONMENT = os.getenv("ENVIRONMENT", "development").lower()
+_IS_PRODUCTION = _ENVIRONMENT == "production"
+
 class Settings(BaseSettings):
     # API version and path settings
     API_V1_STR: str = "/api"
@@ -12,9 +16,15 @@ class Settings(BaseSettings):
     PROJECT_VERSION: str = "1.0.0"
     
     # Security settings
-    SECRET_KEY: str = secrets.token_urlsafe(32)
+    # Set SECRET_KEY when running several workers/instances: a random key differs per process
+    SECRET_KEY: str = Field(default_factory=lambda: os.getenv("SECRET_KEY") or secrets.token_urlsafe(32))
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30  # 30 minutes
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7    # 7 days
+    # Threads for bcrypt hashing/verification (bcrypt releases the GIL, so one per core)
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+    # bcrypt cost for new hashes; existing hashes keep verifying at the cost they were made with
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "10"))
+    AUTH_CACHE_TTL_SECONDS: int = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
     
     # Database settings
     POSTGRES_SERVER: str = os.getenv("POSTGRES_SERVER", "localhost")
@@ -23,6 +33,38 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = os.getenv("POSTGRES_DB", "vivuchat")
     POSTGRES_PORT: str = os.getenv("POSTGRES_PORT", "5432")
     SQLALCHEMY_DATABASE_URI: Optional[str] = None
+    # Read replica for read-only endpoints; unset means reads go to the primary
+    POSTGRES_READ_SERVER: Optional[str] = os.getenv("POSTGRES_READ_SERVER")
+    # Create the database on app startup; only the primary container/init job should set this
+    RUN_DB_BOOTSTRAP: bool = os.getenv("RUN_DB_BOOTSTRAP", "0") == "1"
+    
+    # Connection pool settings
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "20"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # Pre-ping costs a round trip per checkout; recycling already retires stale connections
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+    # Set when connecting through PgBouncer in transaction-pooling mode (disables asyncpg's statement caches)
+    DB_USE_PGBOUNCER: bool = os.getenv("DB_USE_PGBOUNCER", "false").lower() == "true"
+    
+    # "production" turns off auto-reload
+    ENVIRONMENT: str = _ENVIRONMENT
+    
+    # Uvicorn worker processes; reload is for development and runs a single worker.
+    # Each worker loads its own embedding model, FAISS index and caches, so more than one
+    # must be asked for explicitly (and needs a shared SECRET_KEY)
+    UVICORN_WORKERS: int = int(os.getenv("UVICORN_WORKERS", "1"))
+    UVICORN_RELOAD: bool = os.getenv("UVICORN_RELOAD", "false" if _IS_PRODUCTION else "true").lower() == "true"
+    
+    # Validate response DTOs built from ORM rows (normally skipped via model_construct)
+    DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
+    
+    # Threadpool size for sync route handlers
+    THREADPOOL_SIZE: int = int(os.getenv("THREADPOOL_SIZE", "200"))
+    
+    # Serve app/static/openapi.json (from scripts/bake_openapi.py) instead of generating the schema
+    OPENAPI_USE_BAKED: bool = os.getenv("OPENAPI_USE_BAKED", "0") == "1"
     
     # CORS settings
     CORS_ORIGINS: List[AnyHttpUrl] = ["http://localhost:5173", "http://localhost:8080", "http://localhost:3000", "http://localhost:80", "http://localhost:443"]
@@ -30,6 +72,17 @@ class Settings(BaseSettings):
     # Ollama settings
     OLLAMA_API_URL: str = os.getenv("OLLAMA_API_URL", "http://ollama:11434/api")
     OLLAMA_API_TIMEOUT: int = int(os.getenv("OLLAMA_API_TIMEOUT", "60"))
+    # Chat completions sent to Ollama at once; match the Ollama server's OLLAMA_NUM_PARALLEL
+    # (start Ollama with OLLAMA_NUM_PARALLEL=N), extra requests wait here instead of in Ollama's queue
+    OLLAMA_NUM_PARALLEL: int = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+    # Completed temperature=0 chat completions kept for identical requests (0 disables)
+    OLLAMA_EXACT_CACHE_SIZE: int = int(os.getenv("OLLAMA_EXACT_CACHE_SIZE", "256"))
+    # HTTP/2 to Ollama when it is reached over https; needs the h2 package (httpx[http2])
+    OLLAMA_HTTP2: bool = os.getenv("OLLAMA_HTTP2", "true").lower() == "true"
+    # How long Ollama keeps a model loaded after a request: seconds, a duration like "30m", or -1 (forever)
+    OLLAMA_KEEP_ALIVE: Union[int, str] = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
+    # Upper bound on the startup model load, so a stuck Ollama can't hold up app startup
+    OLLAMA_WARM_UP_TIMEOUT: int = int(os.getenv("OLLAMA_WARM_UP_TIMEOUT", "120"))
     MAX_OUTPUT_TOKENS: int = int(os.getenv("MAX_OUTPUT_TOKENS", "2048"))
     
     # First admin user settings
@@ -46,14 +99,48 @@ class Settings(BaseSettings):
             return v
         raise ValueError(v)
     
+    @model_validator(mode="after")
+    def check_shared_secret_key(self) -> "Settings":
+        # A generated key differs per process: tokens issued by one worker fail in the others
+        if self.UVICORN_WORKERS > 1 and "SECRET_KEY" not in self.model_fields_set and not os.getenv("SECRET_KEY"):
+            raise ValueError("SECRET_KEY must be set when running more than one Uvicorn worker")
+        return self
+    
+    @field_validator("OLLAMA_KEEP_ALIVE")
+    @classmethod
+    def parse_keep_alive(cls, v: Union[int, str]) -> Union[int, str]:
+        # Ollama reads a JSON string as a Go duration, so plain numbers must be sent as numbers
+        if isinstance(v, str) and v.lstrip("-").isdigit():
+            return int(v)
+        return v
+    
     @property
     def get_database_uri(self) -> str:
         if self.SQLALCHEMY_DATABASE_URI:
             return self.SQLALCHEMY_DATABASE_URI
         return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
     
+    @property
+    def get_async_database_uri(self) -> str:
+        # Same database, but through the asyncpg driver
+        _, rest = self.get_database_uri.split("://", 1)
+        return f"postgresql+asyncpg://{rest}"
+    
+    @property
+    def get_async_read_database_uri(self) -> str:
+        # Same database and credentials on the replica host
+        if not self.POSTGRES_READ_SERVER:
+            return self.get_async_database_uri
+        return (f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}"
+                f"@{self.POSTGRES_READ_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}")
+    
     class Config:
         case_sensitive = True
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build the settings once per process"""
+    return Settings()
+
+settings = get_settings()
\ No newline at end of file
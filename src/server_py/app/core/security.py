@@ -1,30 +1,59 @@
-from datetime import datetime, timedelta
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, Optional, Union
 
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# bcrypt is ~100ms of CPU per call; request handlers run it on a bounded thread pool.
+# bcrypt releases the GIL while hashing, so the threads use all cores
+_pw_pool: Optional[ThreadPoolExecutor] = None
+
+def _get_pw_pool() -> ThreadPoolExecutor:
+    global _pw_pool
+    if _pw_pool is None:
+        _pw_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _pw_pool
+
+def shutdown_password_pool():
+    """
+    Stop the password hashing threads
+    """
+    global _pw_pool
+    if _pw_pool is not None:
+        _pw_pool.shutdown(wait=False, cancel_futures=True)
+        _pw_pool = None
 
 def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT access token for the user
     """
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = datetime.now(timezone.utc) + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
     to_encode = {"exp": expire, "sub": str(subject)}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
-def create_refresh_token(subject: Union[str, Any]) -> str:
+def refresh_token_expiry() -> datetime:
+    """
+    Expiry for a refresh token issued now
+    """
+    return datetime.now(timezone.utc) + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+
+def create_refresh_token(subject: Union[str, Any], expire: Optional[datetime] = None) -> str:
     """
-    Create a JWT refresh token for the user
+    Create a JWT refresh token for the user.
+    Pass the expiry stored with the token so both agree.
     """
-    expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    if expire is None:
+        expire = refresh_token_expiry()
     to_encode = {"exp": expire, "sub": str(subject), "type": "refresh"}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm="HS256")
     return encoded_jwt
@@ -41,6 +70,20 @@ def get_password_hash(password: str) -> str:
     """
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    Verify a password against a hash without blocking the event loop
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pw_pool(), verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    Hash a password for storing without blocking the event loop
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pw_pool(), get_password_hash, password)
+
 def decode_token(token: str) -> Dict[str, Any]:
     """
     Decode a JWT token
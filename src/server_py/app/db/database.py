@@ -1,48 +1,59 @@
 from sqlalchemy import create_engine, inspect
+from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 import psycopg2
+import uuid
+from psycopg2 import sql
 import logging
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
-def check_and_create_database():
+def connect_to_server():
     """
-    Check if the database exists, and create it if it doesn't
+    Open an autocommit connection to the PostgreSQL server's default 'postgres' database
     """
-    # Connect to PostgreSQL default database
-    connection_string = f"postgresql://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_SERVER}:{settings.POSTGRES_PORT}/postgres"
+    conn = psycopg2.connect(
+        user=settings.POSTGRES_USER,
+        password=settings.POSTGRES_PASSWORD,
+        host=settings.POSTGRES_SERVER,
+        port=settings.POSTGRES_PORT,
+        database="postgres"
+    )
+    
+    # Set autocommit mode to create database
+    conn.autocommit = True
+    return conn
+
+def check_and_create_database(conn=None):
+    """
+    Check if the database exists, and create it if it doesn't.
+    Uses the given server connection if any, otherwise opens (and closes) its own.
+    """
+    own_conn = conn is None
     
     try:
         logger.info(f"Checking if database '{settings.POSTGRES_DB}' exists...")
         
-        # Connect to the PostgreSQL server (using default 'postgres' database)
-        conn = psycopg2.connect(
-            user=settings.POSTGRES_USER,
-            password=settings.POSTGRES_PASSWORD,
-            host=settings.POSTGRES_SERVER,
-            port=settings.POSTGRES_PORT,
-            database="postgres"
-        )
-        
-        # Set autocommit mode to create database
-        conn.autocommit = True
-        cursor = conn.cursor()
+        if own_conn:
+            conn = connect_to_server()
         
-        # Check if database exists
-        cursor.execute(f"SELECT 1 FROM pg_catalog.pg_database WHERE datname = '{settings.POSTGRES_DB}'")
-        exists = cursor.fetchone()
-        
-        if not exists:
-            logger.info(f"Database '{settings.POSTGRES_DB}' does not exist. Creating...")
-            cursor.execute(f"CREATE DATABASE {settings.POSTGRES_DB}")
-            logger.info(f"Database '{settings.POSTGRES_DB}' created successfully!")
-        else:
-            logger.info(f"Database '{settings.POSTGRES_DB}' already exists.")
-        
-        cursor.close()
-        conn.close()
+        with conn.cursor() as cursor:
+            # Check if database exists
+            cursor.execute(
+                "SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s",
+                (settings.POSTGRES_DB,)
+            )
+            exists = cursor.fetchone()
+            
+            if not exists:
+                logger.info(f"Database '{settings.POSTGRES_DB}' does not exist. Creating...")
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(settings.POSTGRES_DB)))
+                logger.info(f"Database '{settings.POSTGRES_DB}' created successfully!")
+            else:
+                logger.info(f"Database '{settings.POSTGRES_DB}' already exists.")
         
         # Log successful connection
         logger.info(f"Connection to PostgreSQL server at {settings.POSTGRES_SERVER}:{settings.POSTGRES_PORT} successful!")
@@ -51,25 +62,77 @@ def check_and_create_database():
     except Exception as e:
         logger.error(f"Error connecting to PostgreSQL server or creating database: {e}")
         return False
+    finally:
+        if own_conn and conn is not None:
+            conn.close()
 
-# Try to create database if needed
-database_ready = check_and_create_database()
-if not database_ready:
-    logger.warning("Unable to verify database existence or create it. Proceeding with configured connection.")
+def get_engine_options(use_asyncpg: bool = False) -> dict:
+    """
+    Connection pool options shared by the sync and async engines
+    """
+    if settings.DB_USE_PGBOUNCER:
+        # PgBouncer does the pooling, so don't hold connections in-process
+        options = {"poolclass": NullPool}
+        if use_asyncpg:
+            # In transaction mode consecutive statements may run on different server connections,
+            # so asyncpg must not cache prepared statements, and the ones it does create need
+            # names that can't collide with another client's on the same backend
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+        return options
+    
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
 
-# Create SQLAlchemy engine
-engine = create_engine(settings.get_database_uri)
+# Create SQLAlchemy engine (used by init scripts only)
+engine = create_engine(settings.get_database_uri, **get_engine_options())
 
 # Create SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Create async engine (asyncpg) used by request handlers
+async_engine = create_async_engine(settings.get_async_database_uri, **get_engine_options(use_asyncpg=True))
+
+# Create AsyncSessionLocal class
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Engine for read-only endpoints: its own pool on the replica when POSTGRES_READ_SERVER is set,
+# otherwise the primary's pool; either way transactions are opened READ ONLY
+if settings.POSTGRES_READ_SERVER:
+    read_engine = create_async_engine(settings.get_async_read_database_uri, **get_engine_options(use_asyncpg=True))
+else:
+    read_engine = async_engine
+read_engine = read_engine.execution_options(postgresql_readonly=True)
+
+ReadSessionLocal = async_sessionmaker(bind=read_engine, autoflush=False, expire_on_commit=False)
 
 # Create Base class for models
-Base = declarative_base()
+# AsyncAttrs exposes `obj.awaitable_attrs.<relationship>` for lazy loads under AsyncSession
+Base = declarative_base(cls=AsyncAttrs)
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+# Dependency to get async DB session
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception:
+            # Don't hand a connection with a failed transaction back to the pool
+            await db.rollback()
+            raise
+
+# Dependency to get a read-only async DB session
+async def get_read_db():
+    async with ReadSessionLocal() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
@@ -1,7 +1,7 @@
 import time
 import logging
-from sqlalchemy import inspect
-from app.db.database import engine, Base, check_and_create_database
+from sqlalchemy import DateTime, inspect, text
+from app.db.database import engine, Base, check_and_create_database, connect_to_server
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -10,20 +10,86 @@ def ensure_database_exists():
     """Ensure that the database exists before attempting to create tables"""
     retry_count = 0
     max_retries = 5
+    # Reused across attempts once the server accepts a connection
+    conn = None
     
-    while retry_count < max_retries:
-        if check_and_create_database():
-            logger.info(f"Database '{settings.POSTGRES_DB}' is ready.")
-            return True
-        
-        retry_count += 1
-        wait_time = retry_count * 2
-        logger.warning(f"Failed to create/verify database. Retrying in {wait_time} seconds... ({retry_count}/{max_retries})")
-        time.sleep(wait_time)
+    try:
+        while retry_count < max_retries:
+            try:
+                if conn is None or conn.closed:
+                    conn = connect_to_server()
+            except Exception as e:
+                logger.error(f"Error connecting to PostgreSQL server: {e}")
+            else:
+                if check_and_create_database(conn):
+                    logger.info(f"Database '{settings.POSTGRES_DB}' is ready.")
+                    return True
+            
+            retry_count += 1
+            wait_time = retry_count * 2
+            logger.warning(f"Failed to create/verify database. Retrying in {wait_time} seconds... ({retry_count}/{max_retries})")
+            time.sleep(wait_time)
+    finally:
+        if conn is not None and not conn.closed:
+            conn.close()
     
     logger.error(f"Failed to create/verify database after {max_retries} attempts.")
     return False
 
+def upgrade_timestamp_columns():
+    """
+    Convert naive timestamp columns to TIMESTAMP WITH TIME ZONE (stored values are UTC)
+    and add the now() server defaults that replaced the Python-side defaults
+    """
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"]: column for column in inspector.get_columns(table.name)}
+            
+            for column in table.columns:
+                existing = existing_columns.get(column.name)
+                if existing is None or not isinstance(column.type, DateTime):
+                    continue
+                
+                table_name, column_name = quote(table.name), quote(column.name)
+                if column.type.timezone and not getattr(existing["type"], "timezone", False):
+                    logger.info(f"Converting {table.name}.{column.name} to TIMESTAMP WITH TIME ZONE")
+                    conn.execute(text(
+                        f"ALTER TABLE {table_name} ALTER COLUMN {column_name} "
+                        f"TYPE TIMESTAMP WITH TIME ZONE USING {column_name} AT TIME ZONE 'UTC'"
+                    ))
+                if column.server_default is not None and existing["default"] is None:
+                    conn.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} SET DEFAULT now()"))
+
+# Extensions the models' indexes depend on
+REQUIRED_EXTENSIONS = ["pg_trgm"]
+
+def ensure_extensions():
+    """Create the Postgres extensions used by model indexes (before create_all needs them)"""
+    quote = engine.dialect.identifier_preparer.quote
+    
+    with engine.begin() as conn:
+        for name in REQUIRED_EXTENSIONS:
+            conn.execute(text(f"CREATE EXTENSION IF NOT EXISTS {quote(name)}"))
+
+# Indexes superseded by newer model indexes (a wider one on the same leading columns,
+# per-column trigram indexes for the user search)
+RETIRED_INDEXES = ["ix_refresh_tokens_user_revoked", "ix_users_search_trgm"]
+
+def create_missing_indexes():
+    """create_all only indexes new tables, so add model indexes missing from existing ones"""
+    quote = engine.dialect.identifier_preparer.quote
+    
+    with engine.begin() as conn:
+        for name in RETIRED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {quote(name)}"))
+        
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
 def create_tables():
     """Create all tables defined in models"""
     try:
@@ -42,8 +108,13 @@ def create_tables():
             logger.info("No existing tables found. Creating all tables...")
         
         # Create all tables
+        ensure_extensions()
         Base.metadata.create_all(bind=engine)
         
+        # Tables created by older versions need their timestamp columns brought up to date
+        upgrade_timestamp_columns()
+        create_missing_indexes()
+        
         # Verify tables were created
         inspector = inspect(engine)
         created_tables = inspector.get_table_names()
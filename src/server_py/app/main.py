@@ -1,18 +1,71 @@
-from fastapi import FastAPI
+import asyncio
+import hashlib
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple
+import anyio
+import orjson
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.openapi.docs import get_swagger_ui_html
+from fastapi.responses import ORJSONResponse
+from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 from fastapi.security import OAuth2PasswordBearer
 from app.api.routes import auth, users, chats, admin, ollama, rag
+from app.api.middleware import BearerTokenMiddleware
 from app.core.config import settings
+from app.core.security import shutdown_password_pool
+from app.db.database import check_and_create_database
+from app.services.ollama_service import OllamaService
+from app.services.rag_processor import LLM_MODEL, RAGProcessor, create_rag_processor
+
+logger = logging.getLogger(__name__)
+
+OPENAPI_URL = f"{settings.API_V1_STR}/openapi.json"
+# Written by scripts/bake_openapi.py
+OPENAPI_BAKED_PATH = os.path.join(os.path.dirname(__file__), "static", "openapi.json")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync handlers and dependencies run on anyio's threadpool (40 threads by default);
+    # raise the limit so bursts of sync work can't starve each other
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+    
+    # server.py bootstraps the database before starting uvicorn; plain `uvicorn app.main:app`
+    # deployments opt in here so extra workers don't each hit the postgres admin DB
+    if settings.RUN_DB_BOOTSTRAP:
+        if not await asyncio.to_thread(check_and_create_database):
+            logger.warning("Unable to verify database existence or create it. Proceeding with configured connection.")
+    
+    render_static_docs()
+    
+    # Load the embedding model and FAISS index before taking traffic, off the event loop
+    try:
+        app.state.rag_processor = await asyncio.to_thread(create_rag_processor)
+    except Exception as e:
+        logger.error(f"Failed to initialize RAG processor at startup: {e}")
+        # The processor loads its model/index on first use
+        app.state.rag_processor = RAGProcessor()
+    
+    # Pay the LLM load time now rather than on the first user request
+    await OllamaService.warm_up(LLM_MODEL)
+    yield
+    
+    shutdown_password_pool()
+    await OllamaService.close_clients()
 
 app = FastAPI(
+    lifespan=lifespan,
+    # orjson serializes response bodies (datetimes, UUIDs) natively
+    default_response_class=ORJSONResponse,
     title=settings.PROJECT_NAME,
     description=settings.PROJECT_DESCRIPTION,
     version=settings.PROJECT_VERSION,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    # Schema and docs pages are served from a cache rendered at startup (see below)
+    openapi_url=None,
     docs_url=None,  # Disable default docs
-    redoc_url="/redoc",
+    redoc_url=None,
 )
 
 # Custom OpenAPI schema function
@@ -45,17 +98,64 @@ def custom_openapi():
     app.openapi_schema = openapi_schema
     return app.openapi_schema
 
-# Custom Swagger UI with better configuration
+# Pre-rendered OpenAPI schema and docs pages: key -> (body, etag)
+_static_docs: Dict[str, Tuple[bytes, str]] = {}
+_DOCS_CACHE_CONTROL = "public, max-age=3600"
+
+def load_openapi_schema() -> bytes:
+    """
+    The OpenAPI schema as JSON bytes: the baked file when OPENAPI_USE_BAKED is set
+    (release builds), otherwise generated from the routes (development)
+    """
+    if settings.OPENAPI_USE_BAKED and os.path.exists(OPENAPI_BAKED_PATH):
+        with open(OPENAPI_BAKED_PATH, "rb") as f:
+            schema_bytes = f.read()
+        app.openapi_schema = orjson.loads(schema_bytes)
+        return schema_bytes
+    
+    return orjson.dumps(app.openapi())
+
+def render_static_docs():
+    """Render the OpenAPI schema and docs pages once, after all routers are included"""
+    pages = {
+        "openapi": load_openapi_schema(),
+        # Custom Swagger UI with better configuration
+        "swagger": get_swagger_ui_html(
+            openapi_url=OPENAPI_URL,
+            title=f"{settings.PROJECT_NAME} - Swagger UI",
+            oauth2_redirect_url=None,
+            swagger_js_url="https://cdn.jsdelivr.net/npm/swagger-ui-dist@5.9.0/swagger-ui-bundle.js",
+            swagger_css_url="https://cdn.jsdelivr.net/npm/swagger-ui-dist@5.9.0/swagger-ui.css",
+            swagger_favicon_url="/favicon.ico",
+        ).body,
+        "redoc": get_redoc_html(
+            openapi_url=OPENAPI_URL,
+            title=f"{settings.PROJECT_NAME} - ReDoc",
+        ).body,
+    }
+    for key, body in pages.items():
+        _static_docs[key] = (body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+
+def static_docs_response(request: Request, key: str, media_type: str) -> Response:
+    if key not in _static_docs:
+        render_static_docs()
+    body, etag = _static_docs[key]
+    headers = {"Cache-Control": _DOCS_CACHE_CONTROL, "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+@app.get(OPENAPI_URL, include_in_schema=False)
+async def openapi_json(request: Request):
+    return static_docs_response(request, "openapi", "application/json")
+
 @app.get("/docs", include_in_schema=False)
-async def custom_swagger_ui_html():
-    return get_swagger_ui_html(
-        openapi_url=f"{settings.API_V1_STR}/openapi.json",
-        title=f"{settings.PROJECT_NAME} - Swagger UI",
-        oauth2_redirect_url=None,
-        swagger_js_url="https://cdn.jsdelivr.net/npm/swagger-ui-dist@5.9.0/swagger-ui-bundle.js",
-        swagger_css_url="https://cdn.jsdelivr.net/npm/swagger-ui-dist@5.9.0/swagger-ui.css",
-        swagger_favicon_url="/favicon.ico",
-    )
+async def custom_swagger_ui_html(request: Request):
+    return static_docs_response(request, "swagger", "text/html")
+
+@app.get("/redoc", include_in_schema=False)
+async def redoc_html(request: Request):
+    return static_docs_response(request, "redoc", "text/html")
 
 # Assign custom openapi function
 app.openapi = custom_openapi
@@ -69,6 +169,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Extract the bearer token once for the auth dependencies
+app.add_middleware(BearerTokenMiddleware)
+
 # Include API routes
 app.include_router(auth.router, prefix=settings.API_V1_STR)
 app.include_router(users.router, prefix=settings.API_V1_STR)
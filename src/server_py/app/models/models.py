@@ -1,8 +1,9 @@
-import uuid
-from datetime import datetime
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Table, Text
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String, Table, Text, func
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
+# Primary keys are time-ordered UUIDv7 (stdlib uuid.UUID values), so new rows land on the
+# rightmost leaf of the primary key B-tree instead of random pages
+from uuid_utils.compat import uuid7
 
 from app.db.database import Base
 
@@ -11,13 +12,17 @@ user_role = Table(
     "user_roles",
     Base.metadata,
     Column("user_id", UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True),
-    Column("role_id", UUID(as_uuid=True), ForeignKey("roles.id"), primary_key=True)
+    Column("role_id", UUID(as_uuid=True), ForeignKey("roles.id"), primary_key=True),
+    # The (user_id, role_id) primary key can't serve lookups by role alone
+    Index("ix_user_roles_role_id", "role_id")
 )
 
 class User(Base):
     __tablename__ = "users"
+    # Fetch server-generated timestamps with RETURNING on INSERT and UPDATE
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     username = Column(String(50), unique=True, nullable=False, index=True)
     email = Column(String(100), unique=True, nullable=False, index=True)
     password = Column(String(255), nullable=False)
@@ -26,19 +31,31 @@ class User(Base):
     avatar_url = Column(String(1024), nullable=True)
     phone_number = Column(String(20), nullable=True)
     is_active = Column(Boolean, default=True, nullable=False)
-    locked_until = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     
     # Relationships
     roles = relationship("Role", secondary=user_role, back_populates="users")
     chats = relationship("Chat", back_populates="user", cascade="all, delete-orphan")
     refresh_tokens = relationship("RefreshToken", back_populates="user", cascade="all, delete-orphan")
+    
+    # Trigram indexes let the admin search's ILIKE '%x%' on each column use an index instead of
+    # scanning users (needs the pg_trgm extension; terms under 3 characters can't use them)
+    __table_args__ = (
+        Index("ix_users_username_trgm", username, postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}),
+        Index("ix_users_email_trgm", email, postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"}),
+        Index("ix_users_first_name_trgm", first_name, postgresql_using="gin", postgresql_ops={"first_name": "gin_trgm_ops"}),
+        Index("ix_users_last_name_trgm", last_name, postgresql_using="gin", postgresql_ops={"last_name": "gin_trgm_ops"}),
+    )
+
+# Columns matched by the admin user search, each ORed with its own ILIKE
+USER_SEARCH_COLUMNS = (User.username, User.email, User.first_name, User.last_name)
 
 class Role(Base):
     __tablename__ = "roles"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     name = Column(String(50), unique=True, nullable=False)
     description = Column(String(255), nullable=True)
     
@@ -48,11 +65,11 @@ class Role(Base):
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     token = Column(String(255), unique=True, nullable=False, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
-    expires_at = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     is_revoked = Column(Boolean, default=False, nullable=False)
     revoked_reason = Column(String(255), nullable=True)
     is_used = Column(Boolean, default=False, nullable=False)
@@ -60,32 +77,50 @@ class RefreshToken(Base):
     
     # Relationships
     user = relationship("User", back_populates="refresh_tokens")
+    
+    # Finding a user's active tokens (logout, revoke-all) and purging expired ones without scanning the table
+    __table_args__ = (
+        Index("ix_refresh_tokens_user_revoked_expires", user_id, is_revoked, expires_at),
+        Index("ix_refresh_tokens_expires_at", expires_at),
+    )
 
 class Chat(Base):
     __tablename__ = "chats"
+    # Fetch server-generated timestamps with RETURNING on INSERT and UPDATE
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     title = Column(String(255), nullable=True)
     description = Column(String(1000), nullable=True)
     model = Column(String(50), nullable=False)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     
     # Relationships
     user = relationship("User", back_populates="chats")
     messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
+    
+    # Keyset pagination index for listing a user's chats
+    __table_args__ = (
+        Index("ix_chats_user_updated_id", user_id, updated_at.desc(), id.desc()),
+    )
 
 class Message(Base):
     __tablename__ = "messages"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     role = Column(String(20), nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
     chat_id = Column(UUID(as_uuid=True), ForeignKey("chats.id"), nullable=False)
     model = Column(String(50), nullable=True)
     tokens = Column(Integer, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # Relationships
-    chat = relationship("Chat", back_populates="messages")
\ No newline at end of file
+    chat = relationship("Chat", back_populates="messages")
+    
+    # Fetching a chat's messages in order is an index range scan
+    __table_args__ = (
+        Index("ix_messages_chat_created", chat_id, created_at),
+    )
\ No newline at end of file
@@ -1,15 +1,11 @@
 import uuid
-from datetime import datetime, timezone
 from typing import List, Optional, Any
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
 
-class JsonConfig:
-    """Pydantic config for JSON serialization that converts datetimes to ISO format with timezone"""
-    @classmethod
-    def json_encoders(cls):
-        return {
-            datetime: lambda dt: dt.replace(tzinfo=timezone.utc).isoformat().replace('+00:00', 'Z')
-        }
+def to_camel(name: str) -> str:
+    """snake_case field name -> camelCase alias (evaluated once per field at class creation)"""
+    first, *rest = name.split('_')
+    return first + ''.join(word.capitalize() for word in rest)
 
 # Base schemas
 class RoleBase(BaseModel):
@@ -77,12 +73,8 @@ class JWTResponse(BaseModel):
     email: EmailStr
     roles: List[str]
     
-    model_config = ConfigDict(
-        # This allows the model to be initialized with snake_case field names
-        # but respond with camelCase field names
-        populate_by_name=True,
-        alias_generator=lambda s: s.replace('_', '')
-    )
+    # Field names are already the camelCase names the frontend expects, so no aliases
+    model_config = ConfigDict(populate_by_name=True)
 
 # Schema for message response
 class MessageResponse(BaseModel):
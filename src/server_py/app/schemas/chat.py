@@ -2,8 +2,9 @@ import uuid
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, Field, ConfigDict
+from typing_extensions import TypedDict
 
-from app.schemas.base import ChatBase, MessageBase
+from app.schemas.base import ChatBase, MessageBase, to_camel
 from app.core.config import settings
 
 # Chat request/response schemas
@@ -23,45 +24,35 @@ class ChatMessageResponse(BaseModel):
     
     model_config = ConfigDict(
         from_attributes=True,
-        json_encoders={datetime: lambda dt: dt.replace(tzinfo=None).isoformat() + "Z"},
         populate_by_name=True,
-        alias_generator=lambda s: ''.join([s.split('_')[0]] + [w.capitalize() for w in s.split('_')[1:]])
+        alias_generator=to_camel
     )
 
-    @property
-    def createdAt(self) -> str:
-        if self.created_at:
-            return self.created_at.replace(tzinfo=None).isoformat() + "Z"
-        return None
+# Messages nested in ChatResponse are plain dicts built from ORM rows, so there is
+# no per-message model instance; keys are already the camelCase JSON names
+class ChatMessageDict(TypedDict):
+    id: uuid.UUID
+    role: str
+    content: str
+    tokens: Optional[int]
+    model: Optional[str]
+    createdAt: datetime
 
 class ChatResponse(BaseModel):
     id: uuid.UUID
     title: str
     description: Optional[str] = None
     model: str
-    messages: List[ChatMessageResponse] = []
+    messages: List[ChatMessageDict] = []
     created_at: datetime
     updated_at: datetime
     
     model_config = ConfigDict(
         from_attributes=True,
-        json_encoders={datetime: lambda dt: dt.replace(tzinfo=None).isoformat() + "Z"},
         populate_by_name=True, 
-        alias_generator=lambda s: ''.join([s.split('_')[0]] + [w.capitalize() for w in s.split('_')[1:]])
+        alias_generator=to_camel
     )
 
-    @property
-    def createdAt(self) -> str:
-        if self.created_at:
-            return self.created_at.replace(tzinfo=None).isoformat() + "Z"
-        return None
-    
-    @property
-    def updatedAt(self) -> str:
-        if self.updated_at:
-            return self.updated_at.replace(tzinfo=None).isoformat() + "Z"
-        return None
-
 # Ollama schemas
 class OllamaModelInfo(BaseModel):
     name: str
@@ -115,9 +106,6 @@ class RAGResponse(BaseModel):
     query: str
     query_time_ms: Optional[float] = None
     
-    model_config = ConfigDict(
-        json_encoders={datetime: lambda dt: dt.replace(tzinfo=None).isoformat() + "Z"}
-    )
 
 class RAGBuildIndexResponse(BaseModel):
     success: bool
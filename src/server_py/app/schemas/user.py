@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
 
-from app.schemas.base import UserBase, MessageResponse
+from app.schemas.base import UserBase, MessageResponse, to_camel
 
 # User profile schemas
 class UpdateProfileRequest(BaseModel):
@@ -32,23 +32,9 @@ class UserProfileResponse(BaseModel):
     # Cập nhật để sử dụng ConfigDict và chuẩn hóa tên trường thành camelCase
     model_config = ConfigDict(
         from_attributes=True,
-        json_encoders={datetime: lambda dt: dt.replace(tzinfo=None).isoformat() + "Z"},
         populate_by_name=True,
-        alias_generator=lambda s: ''.join([s.split('_')[0]] + [w.capitalize() for w in s.split('_')[1:]])
+        alias_generator=to_camel
     )
-    
-    # Thêm các thuộc tính để tương thích với frontend
-    @property
-    def createdAt(self) -> str:
-        if self.created_at:
-            return self.created_at.replace(tzinfo=None).isoformat() + "Z"
-        return None
-    
-    @property
-    def updatedAt(self) -> str:
-        if self.updated_at:
-            return self.updated_at.replace(tzinfo=None).isoformat() + "Z"
-        return None
 
 # Admin user schemas
 class UserAdminResponse(UserProfileResponse):
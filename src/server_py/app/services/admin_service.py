@@ -1,55 +1,64 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
-from sqlalchemy import func, or_
+from sqlalchemy import delete, func, or_, select
+from sqlalchemy.orm import selectinload
 import uuid
-from typing import List, Optional
+from datetime import timezone
+from typing import Dict, List, Optional, Tuple
 
-from app.models.models import User, RefreshToken, Role, Chat, Message
+from app.core.config import settings
+from app.models.models import User, RefreshToken, Role, Chat, Message, USER_SEARCH_COLUMNS
 from app.schemas.user import UserAdminResponse, UserStatusUpdateRequest
 from app.schemas.base import MessageResponse
 
 class AdminUserService:
     @staticmethod
-    def find_all_users(db: Session, search: Optional[str] = None, is_active: Optional[bool] = None, 
-                       skip: int = 0, limit: int = 20) -> List[UserAdminResponse]:
+    async def find_all_users(db: AsyncSession, search: Optional[str] = None, is_active: Optional[bool] = None, 
+                             skip: int = 0, limit: int = 20) -> List[UserAdminResponse]:
         """Find all users with optional search and is_active filter"""
-        query = db.query(User)
+        # Roles are mapped for every user, so load them for the whole page in one query
+        query = select(User).options(selectinload(User.roles))
         
         # Apply filters
         if search:
-            search_pattern = f"%{search}%"
-            query = query.filter(or_(
-                User.username.ilike(search_pattern),
-                User.email.ilike(search_pattern),
-                User.first_name.ilike(search_pattern),
-                User.last_name.ilike(search_pattern)
-            ))
+            query = query.where(AdminUserService._search_filter(search))
         
         if is_active is not None:
-            query = query.filter(User.is_active == is_active)
+            query = query.where(User.is_active == is_active)
         
         # Execute query with pagination
-        users = query.order_by(User.created_at.desc()).offset(skip).limit(limit).all()
+        result = await db.execute(query.order_by(User.created_at.desc()).offset(skip).limit(limit))
+        users = result.scalars().all()
+        
+        # Chat/message counts for the whole page in one query
+        counts = await AdminUserService._fetch_counts(db, [user.id for user in users])
         
         # Map to response DTOs
-        return [AdminUserService._map_to_user_admin_response(db, user) for user in users]
+        return [
+            AdminUserService._map_to_user_admin_response(user, *counts.get(user.id, (0, 0)))
+            for user in users
+        ]
     
     @staticmethod
-    def get_user_details(db: Session, user_id: uuid.UUID) -> UserAdminResponse:
+    async def get_user_details(db: AsyncSession, user_id: uuid.UUID) -> UserAdminResponse:
         """Get detailed user information for admin panel"""
-        user = db.query(User).filter(User.id == user_id).first()
+        result = await db.execute(select(User).options(selectinload(User.roles)).where(User.id == user_id))
+        user = result.scalars().first()
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User not found with id: {user_id}"
             )
         
-        return AdminUserService._map_to_user_admin_response(db, user)
+        counts = await AdminUserService._fetch_counts(db, [user.id])
+        return AdminUserService._map_to_user_admin_response(user, *counts.get(user.id, (0, 0)))
     
     @staticmethod
-    def update_user_status(db: Session, user_id: uuid.UUID, update_data: UserStatusUpdateRequest) -> MessageResponse:
+    async def update_user_status(db: AsyncSession, user_id: uuid.UUID, update_data: UserStatusUpdateRequest) -> MessageResponse:
         """Update user active status and/or lock status"""
-        user = db.query(User).filter(User.id == user_id).first()
+        # Roles are needed for the admin check, so load them with the user
+        result = await db.execute(select(User).options(selectinload(User.roles)).where(User.id == user_id))
+        user = result.scalars().first()
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -69,42 +78,61 @@ class AdminUserService:
             user.is_active = update_data.is_active
         
         if update_data.locked_until is not None:
-            user.locked_until = update_data.locked_until
+            locked_until = update_data.locked_until
+            # Naive timestamps from clients are taken as UTC
+            if locked_until.tzinfo is None:
+                locked_until = locked_until.replace(tzinfo=timezone.utc)
+            user.locked_until = locked_until
         
-        db.commit()
+        await db.commit()
         
         status_message = "User account has been activated" if update_data.is_active else "User account has been deactivated"
         
         return MessageResponse(message=status_message, success=True)
     
     @staticmethod
-    def count_total_users(db: Session, search: Optional[str] = None, is_active: Optional[bool] = None) -> int:
+    async def count_total_users(db: AsyncSession, search: Optional[str] = None, is_active: Optional[bool] = None) -> int:
         """Count total users with optional filters"""
-        query = db.query(func.count(User.id))
+        query = select(func.count(User.id))
         
         # Apply filters
         if search:
-            search_pattern = f"%{search}%"
-            query = query.filter(or_(
-                User.username.ilike(search_pattern),
-                User.email.ilike(search_pattern),
-                User.first_name.ilike(search_pattern),
-                User.last_name.ilike(search_pattern)
-            ))
+            query = query.where(AdminUserService._search_filter(search))
         
         if is_active is not None:
-            query = query.filter(User.is_active == is_active)
+            query = query.where(User.is_active == is_active)
         
-        return query.scalar()
+        return await db.scalar(query)
     
     @staticmethod
-    def _map_to_user_admin_response(db: Session, user: User) -> UserAdminResponse:
-        """Map User entity to UserAdminResponse schema"""
-        # Count chats and messages
-        chat_count = db.query(func.count(Chat.id)).filter(Chat.user_id == user.id).scalar()
-        message_count = db.query(func.count(Message.id)).join(Chat).filter(Chat.user_id == user.id).scalar()
-        
-        return UserAdminResponse(
+    def _search_filter(search: str):
+        """
+        Match the term in any search column. Each column has its own trigram index, so a term
+        never matches across field boundaries; terms under 3 characters fall back to a scan
+        """
+        pattern = f"%{search}%"
+        return or_(*(column.ilike(pattern) for column in USER_SEARCH_COLUMNS))
+    
+    @staticmethod
+    async def _fetch_counts(db: AsyncSession, user_ids: List[uuid.UUID]) -> Dict[uuid.UUID, Tuple[int, int]]:
+        """Count chats and messages for several users at once; users without chats are absent"""
+        if not user_ids:
+            return {}
+        
+        result = await db.execute(
+            select(Chat.user_id, func.count(func.distinct(Chat.id)), func.count(Message.id))
+            .outerjoin(Message, Message.chat_id == Chat.id)
+            .where(Chat.user_id.in_(user_ids))
+            .group_by(Chat.user_id)
+        )
+        return {user_id: (chat_count, message_count) for user_id, chat_count, message_count in result.all()}
+    
+    @staticmethod
+    def _map_to_user_admin_response(user: User, chat_count: int, message_count: int) -> UserAdminResponse:
+        """Map User entity (with roles loaded) and its precomputed counts to UserAdminResponse schema"""
+        # ORM data is already typed, so validation is only run in DEBUG
+        build = UserAdminResponse if settings.DEBUG else UserAdminResponse.model_construct
+        return build(
             id=user.id,
             username=user.username,
             email=user.email,
@@ -123,20 +151,14 @@ class AdminUserService:
 
 class AdminTokenService:
     @staticmethod
-    def purge_expired_tokens(db: Session) -> int:
+    async def purge_expired_tokens(db: AsyncSession) -> int:
         """Delete expired tokens from the database"""
-        from datetime import datetime
-        
-        # Count expired tokens
-        count = db.query(func.count(RefreshToken.id)).filter(
-            RefreshToken.expires_at < datetime.utcnow()
-        ).scalar()
-        
-        # Delete expired tokens
-        db.query(RefreshToken).filter(
-            RefreshToken.expires_at < datetime.utcnow()
-        ).delete(synchronize_session=False)
+        # Delete expired tokens; the driver's rowcount gives the count without a separate COUNT query
+        result = await db.execute(delete(RefreshToken).where(
+            RefreshToken.expires_at < func.now()
+        ).execution_options(synchronize_session=False))
+        count = result.rowcount
         
-        db.commit()
+        await db.commit()
         
         return count
\ No newline at end of file
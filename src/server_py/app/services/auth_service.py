@@ -1,37 +1,62 @@
-from datetime import datetime, timedelta
 import uuid
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from fastapi import HTTPException, status
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from app.core.security import verify_password, get_password_hash, create_access_token, create_refresh_token
-from app.models.models import User, RefreshToken, Role
+from app.core.security import verify_password_async, get_password_hash_async, create_access_token, create_refresh_token, refresh_token_expiry
+from app.models.models import User, RefreshToken, Role, user_role
 from app.schemas.base import RegisterRequest, LoginRequest, JWTResponse, RefreshTokenRequest, MessageResponse, LogoutRequest, RevokeTokenRequest
 
+# Requested role names -> role names in the database; anything else is ROLE_USER
+ROLE_NAME_MAP = {"admin": "ROLE_ADMIN", "mod": "ROLE_MODERATOR"}
+
+# Roles are seeded by init_db and never change at runtime, so their ids are cached per process
+_role_ids: Dict[str, uuid.UUID] = {}
+
 class AuthService:
     @staticmethod
-    def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+    async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
         """Authenticate a user with username and password"""
-        user = db.query(User).filter(User.username == username).first()
+        # Roles go into the login response, so load them with the user
+        result = await db.execute(
+            select(User).options(selectinload(User.roles)).where(User.username == username)
+        )
+        user = result.scalars().first()
         if not user:
             return None
-        if not verify_password(password, user.password):
+        if not await verify_password_async(password, user.password):
             return None
         return user
     
     @staticmethod
-    def register_user(db: Session, user_data: RegisterRequest) -> MessageResponse:
+    async def _get_role_ids(db: AsyncSession, role_names: List[str]) -> List[uuid.UUID]:
+        """Resolve role names to ids, querying only names not cached yet (in one query)"""
+        missing = [name for name in role_names if name not in _role_ids]
+        if missing:
+            result = await db.execute(select(Role.name, Role.id).where(Role.name.in_(missing)))
+            _role_ids.update(result.all())
+        
+        # Deduplicate, keeping order; unknown role names are skipped
+        return [_role_ids[name] for name in dict.fromkeys(role_names) if name in _role_ids]
+    
+    @staticmethod
+    async def register_user(db: AsyncSession, user_data: RegisterRequest) -> MessageResponse:
         """Register a new user"""
-        # Check if username already exists
-        if db.query(User).filter(User.username == user_data.username).first():
+        # Check if username / email already exist, in one query without loading user rows
+        result = await db.execute(select(
+            exists().where(User.username == user_data.username),
+            exists().where(User.email == user_data.email)
+        ))
+        username_taken, email_taken = result.one()
+        if username_taken:
             return MessageResponse(message="Username is already taken", success=False)
-        
-        # Check if email already exists
-        if db.query(User).filter(User.email == user_data.email).first():
+        if email_taken:
             return MessageResponse(message="Email is already in use", success=False)
         
         # Create new user
-        hashed_password = get_password_hash(user_data.password)
+        hashed_password = await get_password_hash_async(user_data.password)
         user = User(
             username=user_data.username,
             email=user_data.email,
@@ -39,36 +64,28 @@ class AuthService:
             phone_number=user_data.phone_number
         )
         
-        # Add roles
-        roles = []
-        if user_data.roles and len(user_data.roles) > 0:
-            for role_name in user_data.roles:
-                if role_name == "admin":
-                    role = db.query(Role).filter(Role.name == "ROLE_ADMIN").first()
-                elif role_name == "mod":
-                    role = db.query(Role).filter(Role.name == "ROLE_MODERATOR").first()
-                else:
-                    role = db.query(Role).filter(Role.name == "ROLE_USER").first()
-                
-                if role:
-                    roles.append(role)
+        # Add roles; default role is USER
+        if user_data.roles:
+            role_names = [ROLE_NAME_MAP.get(role_name, "ROLE_USER") for role_name in user_data.roles]
         else:
-            # Default role is USER
-            role = db.query(Role).filter(Role.name == "ROLE_USER").first()
-            if role:
-                roles.append(role)
+            role_names = ["ROLE_USER"]
+        role_ids = await AuthService._get_role_ids(db, role_names)
         
-        user.roles = roles
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.flush()
+        
+        # Link roles by id, without loading Role objects into the session
+        if role_ids:
+            await db.execute(insert(user_role), [{"user_id": user.id, "role_id": role_id} for role_id in role_ids])
+        
+        await db.commit()
         
         return MessageResponse(message="User registered successfully!", success=True)
     
     @staticmethod
-    def login(db: Session, login_data: LoginRequest) -> JWTResponse:
+    async def login(db: AsyncSession, login_data: LoginRequest) -> JWTResponse:
         """Login a user and return JWT tokens"""
-        user = AuthService.authenticate_user(db, login_data.username, login_data.password)
+        user = await AuthService.authenticate_user(db, login_data.username, login_data.password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -79,17 +96,18 @@ class AuthService:
         # Generate access token
         access_token = create_access_token(user.username)
         
-        # Create refresh token
-        refresh_token = create_refresh_token(user.username)
+        # Create refresh token; the JWT and the database row share one expiry
+        expires_at = refresh_token_expiry()
+        refresh_token = create_refresh_token(user.username, expires_at)
         
         # Save refresh token in the database
         token_entity = RefreshToken(
             token=refresh_token,
             user_id=user.id,
-            expires_at=datetime.utcnow() + timedelta(days=7),
+            expires_at=expires_at,
         )
         db.add(token_entity)
-        db.commit()
+        await db.commit()
         
         # Return JWT response
         roles = [role.name for role in user.roles]
@@ -104,14 +122,18 @@ class AuthService:
         )
     
     @staticmethod
-    def refresh_token(db: Session, refresh_request: RefreshTokenRequest) -> JWTResponse:
+    async def refresh_token(db: AsyncSession, refresh_request: RefreshTokenRequest) -> JWTResponse:
         """Refresh access token using a refresh token"""
-        token_entity = db.query(RefreshToken).filter(
+        # Load the token's user and roles in the same round-trips as the token
+        result = await db.execute(select(RefreshToken).options(
+            joinedload(RefreshToken.user).selectinload(User.roles)
+        ).where(
             RefreshToken.token == refresh_request.refresh_token,
             RefreshToken.is_revoked == False,
             RefreshToken.is_used == False,
-            RefreshToken.expires_at > datetime.utcnow()
-        ).first()
+            RefreshToken.expires_at > func.now()
+        ))
+        token_entity = result.scalars().first()
         
         if not token_entity:
             raise HTTPException(
@@ -125,8 +147,9 @@ class AuthService:
         # Generate new access token
         access_token = create_access_token(user.username)
         
-        # Generate new refresh token
-        new_refresh_token = create_refresh_token(user.username)
+        # Generate new refresh token; the JWT and the database row share one expiry
+        expires_at = refresh_token_expiry()
+        new_refresh_token = create_refresh_token(user.username, expires_at)
         
         # Mark old token as used
         token_entity.is_used = True
@@ -136,11 +159,11 @@ class AuthService:
         new_token_entity = RefreshToken(
             token=new_refresh_token,
             user_id=user.id,
-            expires_at=datetime.utcnow() + timedelta(days=7),
+            expires_at=expires_at,
         )
         
         db.add(new_token_entity)
-        db.commit()
+        await db.commit()
         
         # Return JWT response
         roles = [role.name for role in user.roles]
@@ -155,31 +178,33 @@ class AuthService:
         )
     
     @staticmethod
-    def logout(db: Session, logout_request: LogoutRequest) -> MessageResponse:
+    async def logout(db: AsyncSession, logout_request: LogoutRequest) -> MessageResponse:
         """Logout a user by revoking all their refresh tokens"""
         if logout_request and logout_request.username:
-            user = db.query(User).filter(User.username == logout_request.username).first()
-            if user:
-                tokens = db.query(RefreshToken).filter(
-                    RefreshToken.user_id == user.id,
-                    RefreshToken.is_revoked == False,
-                    RefreshToken.expires_at > datetime.utcnow()
-                ).all()
-                
-                for token in tokens:
-                    token.is_revoked = True
-                    token.revoked_reason = "User logged out"
-                
-                db.commit()
+            # Revoke all active tokens in a single UPDATE; the user is resolved by a subquery,
+            # so an unknown username simply matches no rows
+            user_id = select(User.id).where(User.username == logout_request.username).scalar_subquery()
+            result = await db.execute(update(RefreshToken).where(
+                RefreshToken.user_id == user_id,
+                RefreshToken.is_revoked == False,
+                RefreshToken.expires_at > func.now()
+            ).values(
+                is_revoked=True,
+                revoked_reason="User logged out"
+            ).execution_options(synchronize_session=False))
+            
+            if result.rowcount:
+                await db.commit()
         
         return MessageResponse(message="Logout successful", success=True)
     
     @staticmethod
-    def revoke_token(db: Session, revoke_request: RevokeTokenRequest) -> MessageResponse:
+    async def revoke_token(db: AsyncSession, revoke_request: RevokeTokenRequest) -> MessageResponse:
         """Revoke a specific refresh token"""
-        token_entity = db.query(RefreshToken).filter(
+        result = await db.execute(select(RefreshToken).where(
             RefreshToken.token == revoke_request.token
-        ).first()
+        ))
+        token_entity = result.scalars().first()
         
         if not token_entity:
             return MessageResponse(message="Token not found", success=False)
@@ -190,6 +215,6 @@ class AuthService:
         # Revoke the token
         token_entity.is_revoked = True
         token_entity.revoked_reason = revoke_request.reason or "Manually revoked by user"
-        db.commit()
+        await db.commit()
         
         return MessageResponse(message="Token successfully revoked", success=True)
\ No newline at end of file
@@ -1,51 +1,126 @@
+import base64
+import binascii
 import uuid
-from datetime import datetime
-from typing import List, Optional
-from sqlalchemy.orm import Session
+import orjson
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from sqlalchemy import Row, case, exists, func, insert, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 
+from app.core.config import settings
 from app.models.models import Chat, Message, User
-from app.schemas.chat import ChatRequest, MessageRequest, ChatResponse, ChatMessageResponse
+from app.schemas.chat import ChatRequest, MessageRequest, ChatResponse, ChatMessageResponse, ChatMessageDict
+
+# Columns needed to render a message; selecting them instead of Message skips ORM hydration
+MESSAGE_RESPONSE_COLUMNS = (Message.id, Message.role, Message.content, Message.tokens, Message.model, Message.created_at)
 
 class ChatService:
     @staticmethod
-    def create_chat(db: Session, user_id: uuid.UUID, chat_data: ChatRequest) -> ChatResponse:
-        """Create a new chat for a user"""
-        # Create chat entity
-        chat = Chat(
-            title=chat_data.title,
-            description=chat_data.description,
-            model=chat_data.model,
-            user_id=user_id
+    def dumps(obj: Any) -> bytes:
+        """Serialize chat/message dicts; UTC datetimes end in "Z", as in the pydantic response models"""
+        return orjson.dumps(obj, option=orjson.OPT_UTC_Z)
+    
+    @staticmethod
+    def encode_cursor(chat: Chat) -> str:
+        """Encode the (updated_at, id) keyset position of a chat as an opaque cursor"""
+        raw = f"{chat.updated_at.isoformat()}|{chat.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+        """Decode a cursor produced by encode_cursor"""
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            updated_at, chat_id = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+            last_updated_at = datetime.fromisoformat(updated_at)
+            # Cursors issued before timestamps were timezone-aware are UTC
+            if last_updated_at.tzinfo is None:
+                last_updated_at = last_updated_at.replace(tzinfo=timezone.utc)
+            return last_updated_at, uuid.UUID(chat_id)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid pagination cursor"
+            )
+    
+    @staticmethod
+    def _to_message_response(message: Union[Message, Row]) -> ChatMessageResponse:
+        """Build a ChatMessageResponse from a Message row, validating only in DEBUG"""
+        build = ChatMessageResponse if settings.DEBUG else ChatMessageResponse.model_construct
+        return build(
+            id=message.id,
+            role=message.role,
+            content=message.content,
+            model=message.model,
+            tokens=message.tokens,
+            created_at=message.created_at
         )
-        
-        db.add(chat)
-        db.commit()
-        db.refresh(chat)
-        
-        # Return response
-        return ChatResponse(
+    
+    @staticmethod
+    def _to_chat_response(chat: Chat, messages: Sequence[Row] = ()) -> ChatResponse:
+        """Build a ChatResponse from a Chat row and its messages, validating only in DEBUG"""
+        build = ChatResponse if settings.DEBUG else ChatResponse.model_construct
+        return build(
             id=chat.id,
             title=chat.title,
             description=chat.description,
             model=chat.model,
-            messages=[],
+            messages=[ChatService.message_to_dict(msg) for msg in messages],
             created_at=chat.created_at,
             updated_at=chat.updated_at
         )
     
     @staticmethod
-    def add_message(db: Session, chat_id: uuid.UUID, message_data: MessageRequest, role: str, 
-                    model: Optional[str] = None, tokens: Optional[int] = None) -> ChatMessageResponse:
-        """Add a message to an existing chat"""
-        # Find chat
-        chat = db.query(Chat).filter(Chat.id == chat_id).first()
-        if not chat:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Chat not found with id: {chat_id}"
-            )
+    def message_to_dict(message: Union[Message, Row]) -> ChatMessageDict:
+        """Message (entity or MESSAGE_RESPONSE_COLUMNS row) -> JSON-ready dict with the same camelCase keys as ChatMessageResponse"""
+        return {
+            "id": message.id,
+            "role": message.role,
+            "content": message.content,
+            "tokens": message.tokens,
+            "model": message.model,
+            "createdAt": message.created_at
+        }
+    
+    @staticmethod
+    def chat_to_dict(chat: Chat, messages: Sequence[Row] = ()) -> Dict[str, Any]:
+        """Chat row -> JSON-ready dict with the same camelCase keys as ChatResponse"""
+        return {
+            "id": chat.id,
+            "title": chat.title,
+            "description": chat.description,
+            "model": chat.model,
+            "messages": [ChatService.message_to_dict(msg) for msg in messages],
+            "createdAt": chat.created_at,
+            "updatedAt": chat.updated_at
+        }
+    
+    @staticmethod
+    async def create_chat(db: AsyncSession, user_id: uuid.UUID, chat_data: ChatRequest) -> ChatResponse:
+        """Create a new chat for a user"""
+        # INSERT ... RETURNING hands back the server-side timestamps, so no refresh is needed
+        chat = await db.scalar(
+            insert(Chat).values(
+                title=chat_data.title,
+                description=chat_data.description,
+                model=chat_data.model,
+                user_id=user_id
+            ).returning(Chat)
+        )
+        await db.commit()
         
+        # Return response
+        return ChatService._to_chat_response(chat)
+    
+    @staticmethod
+    async def add_message(db: AsyncSession, chat_id: uuid.UUID, message_data: MessageRequest, role: str, 
+                    model: Optional[str] = None, tokens: Optional[int] = None) -> ChatMessageResponse:
+        """
+        Add a message to an existing chat.
+        The chat lookup and the role check share one SELECT, the title check is folded
+        into the chat UPDATE, and the message is written with INSERT ... RETURNING.
+        """
         # Validate message content
         if not message_data.content or message_data.content.strip() == "":
             raise HTTPException(
@@ -54,71 +129,108 @@ class ChatService:
             )
         
         # Improved logic for determining message role, similar to Java implementation
+        has_think_tags = "<think>" in message_data.content or "</think>" in message_data.content
+        
+        # Correlated subquery only when the role has to be inferred
+        columns = [Chat.model]
+        if role != "user" and not has_think_tags:
+            # Role of the most recent message in the chat
+            columns.append(select(Message.role).where(
+                Message.chat_id == Chat.id
+            ).order_by(Message.created_at.desc()).limit(1).scalar_subquery().label("last_role"))
+        
+        # Find chat
+        result = await db.execute(select(*columns).where(Chat.id == chat_id))
+        chat = result.first()
+        if not chat:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Chat not found with id: {chat_id}"
+            )
+        
         determined_role = role
+        chat_values = {"updated_at": func.now()}
         
         # If role is explicitly set to 'user', check if we need to update chat title
         if role == "user":
-            # Get user messages count to determine if this is the first message
-            user_messages = db.query(Message).filter(
-                Message.chat_id == chat_id, 
-                Message.role == "user"
-            ).count()
+            # Get title from the first part of the message
+            title = message_data.content
+            if len(title) > 30:
+                title = title[:27] + "..."
             
-            # If this is the first user message or chat has default title, update the title
-            if user_messages == 0 or chat.title == "New Chat":
-                # Get title from the first part of the message
-                title = message_data.content
-                if len(title) > 30:
-                    title = title[:27] + "..."
-                
-                # Update chat title
-                chat.title = title
+            # Only if this is the first user message or chat has default title; decided by the
+            # database in the UPDATE, so there is no COUNT over the chat's messages
+            has_user_message = exists().where(Message.chat_id == Chat.id, Message.role == "user")
+            chat_values["title"] = case(
+                (or_(Chat.title == "New Chat", ~has_user_message), title),
+                else_=Chat.title
+            )
         
         # Check if message contains thinking tags (indicating an assistant message)
-        elif "<think>" in message_data.content or "</think>" in message_data.content:
+        elif has_think_tags:
             determined_role = "assistant"
-        else:
-            # Look at the most recent message in the chat to infer role
-            recent_messages = db.query(Message).filter(
-                Message.chat_id == chat_id
-            ).order_by(Message.created_at.desc()).limit(1).all()
-            
-            # If the last message was from a user, this is likely the assistant's response
-            if recent_messages and recent_messages[0].role == "user":
-                determined_role = "assistant"
+        # If the last message was from a user, this is likely the assistant's response
+        elif chat.last_role == "user":
+            determined_role = "assistant"
+        
+        # Update chat's updated_at timestamp (and title); before the INSERT so the
+        # first-user-message check doesn't see the message being added
+        await db.execute(update(Chat).where(Chat.id == chat_id).values(**chat_values))
         
         # Create message with the determined role
-        message = Message(
-            role=determined_role,
-            content=message_data.content,
-            chat_id=chat_id,
-            model=model or chat.model,  # Use chat model if not specified
-            tokens=tokens
+        message = await db.scalar(
+            insert(Message).values(
+                role=determined_role,
+                content=message_data.content,
+                chat_id=chat_id,
+                model=model or chat.model,  # Use chat model if not specified
+                tokens=tokens
+            ).returning(Message)
         )
         
-        db.add(message)
+        await db.commit()
         
-        # Update chat's updated_at timestamp
-        chat.updated_at = datetime.utcnow()
+        # Return response
+        return ChatService._to_message_response(message)
+    
+    @staticmethod
+    async def save_assistant_message(db: AsyncSession, chat_id: uuid.UUID, content: str,
+                                     model: Optional[str] = None, tokens: Optional[int] = None) -> uuid.UUID:
+        """
+        Insert a generated assistant message into a chat whose ownership was already checked.
+        Uses Core INSERT ... RETURNING and skips the role inference done by add_message.
+        """
+        message_id = await db.scalar(
+            insert(Message).values(
+                role="assistant",
+                content=content,
+                chat_id=chat_id,
+                model=model,
+                tokens=tokens
+            ).returning(Message.id)
+        )
         
-        db.commit()
-        db.refresh(message)
+        # Update chat's updated_at timestamp
+        await db.execute(update(Chat).where(Chat.id == chat_id).values(updated_at=func.now()))
         
-        # Return response
-        return ChatMessageResponse(
-            id=message.id,
-            role=message.role,
-            content=message.content,
-            model=message.model,
-            tokens=message.tokens,
-            created_at=message.created_at
+        await db.commit()
+        return message_id
+    
+    @staticmethod
+    async def _fetch_messages(db: AsyncSession, chat_id: uuid.UUID) -> Sequence[Row]:
+        """Messages of a chat in creation order, as plain MESSAGE_RESPONSE_COLUMNS rows"""
+        result = await db.execute(
+            select(*MESSAGE_RESPONSE_COLUMNS).where(Message.chat_id == chat_id).order_by(Message.created_at)
         )
+        return result.all()
     
     @staticmethod
-    def get_chat(db: Session, chat_id: uuid.UUID, user_id: uuid.UUID) -> ChatResponse:
-        """Get a chat by ID for a specific user"""
+    async def _find_chat_with_messages(db: AsyncSession, chat_id: uuid.UUID,
+                                       user_id: uuid.UUID) -> Tuple[Chat, Sequence[Row]]:
+        """Load a chat owned by the user together with its messages in creation order"""
         # Find chat with user check
-        chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == user_id).first()
+        result = await db.execute(select(Chat).where(Chat.id == chat_id, Chat.user_id == user_id))
+        chat = result.scalars().first()
         if not chat:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -126,107 +238,94 @@ class ChatService:
             )
         
         # Get messages
-        messages = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.created_at).all()
-        
-        # Map to response
-        message_responses = [
-            ChatMessageResponse(
-                id=msg.id,
-                role=msg.role,
-                content=msg.content,
-                model=msg.model,
-                tokens=msg.tokens,
-                created_at=msg.created_at
-            ) for msg in messages
-        ]
-        
-        return ChatResponse(
-            id=chat.id,
-            title=chat.title,
-            description=chat.description,
-            model=chat.model,
-            messages=message_responses,
-            created_at=chat.created_at,
-            updated_at=chat.updated_at
-        )
+        return chat, await ChatService._fetch_messages(db, chat_id)
     
     @staticmethod
-    def list_user_chats(db: Session, user_id: uuid.UUID, skip: int = 0, limit: int = 20) -> List[ChatResponse]:
-        """List all chats for a user"""
-        # Get chats with pagination
-        chats = db.query(Chat).filter(Chat.user_id == user_id).order_by(
-            Chat.updated_at.desc()
-        ).offset(skip).limit(limit).all()
-        
-        # Map to response
-        chat_responses = []
-        for chat in chats:
-            chat_responses.append(ChatResponse(
-                id=chat.id,
-                title=chat.title,
-                description=chat.description,
-                model=chat.model,
-                messages=[],  # Skip messages for list view
-                created_at=chat.created_at,
-                updated_at=chat.updated_at
-            ))
-        
-        return chat_responses
+    async def get_chat(db: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID) -> ChatResponse:
+        """Get a chat by ID for a specific user"""
+        chat, messages = await ChatService._find_chat_with_messages(db, chat_id, user_id)
+        return ChatService._to_chat_response(chat, messages)
     
     @staticmethod
-    def update_chat(db: Session, chat_id: uuid.UUID, user_id: uuid.UUID, 
-                    update_data: ChatRequest) -> ChatResponse:
-        """Update chat title, description or model"""
-        # Find chat with user check
-        chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == user_id).first()
-        if not chat:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Chat not found with id: {chat_id}"
-            )
+    async def list_user_chats(db: AsyncSession, user_id: uuid.UUID, cursor: Optional[str] = None,
+                              limit: int = 20, include_total: bool = False
+                              ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[int]]:
+        """
+        List chats for a user, most recently updated first, using keyset pagination.
+        Returns the page, the cursor of the next page (None on the last page) and,
+        if include_total is set on the first page, the user's total chat count.
+        Chats are returned as JSON-ready dicts (see chat_to_dict).
+        """
+        # The total rides along on each row as a window count, so it costs no extra round-trip
+        with_total = include_total and not cursor
+        if with_total:
+            query = select(Chat, func.count().over().label("total")).where(Chat.user_id == user_id)
+        else:
+            query = select(Chat).where(Chat.user_id == user_id)
+        
+        # Continue after the last chat of the previous page
+        if cursor:
+            last_updated_at, last_id = ChatService.decode_cursor(cursor)
+            query = query.where(tuple_(Chat.updated_at, Chat.id) < tuple_(last_updated_at, last_id))
+        
+        # Fetch one extra row to know whether there is a next page
+        result = await db.execute(query.order_by(
+            Chat.updated_at.desc(), Chat.id.desc()
+        ).limit(limit + 1))
+        
+        total = None
+        if with_total:
+            rows = result.all()
+            chats = [row.Chat for row in rows]
+            total = rows[0].total if rows else 0
+        else:
+            chats = result.scalars().all()
+        
+        has_next = len(chats) > limit
+        chats = chats[:limit]
+        next_cursor = ChatService.encode_cursor(chats[-1]) if has_next else None
         
+        # Map to response (messages are skipped for list view)
+        chat_responses = [ChatService.chat_to_dict(chat) for chat in chats]
+        
+        return chat_responses, next_cursor, total
+    
+    @staticmethod
+    async def update_chat(db: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID, 
+                          update_data: ChatRequest) -> ChatResponse:
+        """Update chat title, description or model"""
         # Update fields
+        values = {"updated_at": func.now()}
         if update_data.title is not None:
-            chat.title = update_data.title
+            values["title"] = update_data.title
         if update_data.description is not None:
-            chat.description = update_data.description
+            values["description"] = update_data.description
         if update_data.model is not None:
-            chat.model = update_data.model
+            values["model"] = update_data.model
         
-        chat.updated_at = datetime.utcnow()
+        # Update with user check; RETURNING replaces both the lookup and the refresh
+        chat = await db.scalar(
+            update(Chat).where(Chat.id == chat_id, Chat.user_id == user_id).values(**values).returning(Chat)
+        )
+        if not chat:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Chat not found with id: {chat_id}"
+            )
         
-        db.commit()
-        db.refresh(chat)
+        await db.commit()
         
         # Get messages for response
-        messages = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.created_at).all()
-        
-        message_responses = [
-            ChatMessageResponse(
-                id=msg.id,
-                role=msg.role,
-                content=msg.content,
-                model=msg.model,
-                tokens=msg.tokens,
-                created_at=msg.created_at
-            ) for msg in messages
-        ]
-        
-        return ChatResponse(
-            id=chat.id,
-            title=chat.title,
-            description=chat.description,
-            model=chat.model,
-            messages=message_responses,
-            created_at=chat.created_at,
-            updated_at=chat.updated_at
-        )
+        messages = await ChatService._fetch_messages(db, chat_id)
+        
+        return ChatService._to_chat_response(chat, messages)
     
     @staticmethod
-    def delete_chat(db: Session, chat_id: uuid.UUID, user_id: uuid.UUID) -> bool:
+    async def delete_chat(db: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID) -> bool:
         """Delete a chat and all its messages"""
         # Find chat with user check
-        chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == user_id).first()
+        result = await db.execute(select(Chat).where(Chat.id == chat_id, Chat.user_id == user_id))
+        chat = result.scalars().first()
         if not chat:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -234,7 +333,7 @@ class ChatService:
             )
         
         # Delete chat (cascade will handle messages)
-        db.delete(chat)
-        db.commit()
+        await db.delete(chat)
+        await db.commit()
         
         return True
\ No newline at end of file
@@ -1,50 +1,89 @@
-import aiohttp
 import asyncio
-import json
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple
+import re
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple, Union
 from fastapi import HTTPException, status
 import httpx
+import orjson
 
 from app.core.config import settings
 from app.schemas.chat import OllamaModelInfo, OllamaChatCompletionRequest, OllamaAvailableModelInfo, OllamaAvailableModelsResponse
 
 logger = logging.getLogger(__name__)
 
+# Trailing UTC marker ("+00:00" or "Z"), or the end of a timestamp that has no offset at all
+_TZ_SUFFIX_RE = re.compile(r'(?:\+00:00|Z|(?<![+-]\d\d:\d\d))$')
+
 class OllamaService:
     # Default model to use if no model is specified
     DEFAULT_MODEL = "llama3.1:8b"
     
+    # Shared client so calls (including streamed chats) reuse connections to Ollama; created on first use
+    _client: Optional[httpx.AsyncClient] = None
+    
+    # Bounds in-flight chat completions to the slots Ollama serves in parallel
+    _parallel_sem = asyncio.Semaphore(settings.OLLAMA_NUM_PARALLEL)
+    
+    # Deterministic (temperature=0) completions by request hash, least recently used first
+    _exact_cache: "OrderedDict[str, str]" = OrderedDict()
+    
+    @staticmethod
+    def get_client() -> httpx.AsyncClient:
+        """
+        Get the shared Ollama API client
+        """
+        if OllamaService._client is None or OllamaService._client.is_closed:
+            OllamaService._client = httpx.AsyncClient(
+                base_url=settings.OLLAMA_API_URL,
+                timeout=settings.OLLAMA_API_TIMEOUT,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+                # Negotiated via ALPN on https endpoints (e.g. behind a proxy); plain http stays on 1.1
+                http2=settings.OLLAMA_HTTP2
+            )
+        return OllamaService._client
+    
+    @staticmethod
+    async def close_clients():
+        """
+        Close the shared Ollama API client (app shutdown)
+        """
+        if OllamaService._client is not None:
+            await OllamaService._client.aclose()
+            OllamaService._client = None
+    
     @staticmethod
     async def list_models() -> List[OllamaModelInfo]:
         """
         List all available models from Ollama API
         """
         try:
-            async with httpx.AsyncClient(timeout=settings.OLLAMA_API_TIMEOUT) as client:
-                response = await client.get(f"{settings.OLLAMA_API_URL}/tags")
-                
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=status.HTTP_502_BAD_GATEWAY,
-                        detail=f"Error fetching models from Ollama: {response.text}"
-                    )
-                
-                data = response.json()
-                models = []
-                
-                for model_data in data.get("models", []):
-                    model = OllamaModelInfo(
-                        name=model_data.get("name"),
-                        modified_at=model_data.get("modified_at"),
-                        size=model_data.get("size"),
-                        digest=model_data.get("digest"),
-                        details=model_data.get("details")
-                    )
-                    models.append(model)
-                
-                return models
-                
+            response = await OllamaService.get_client().get("/tags")
+            
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"Error fetching models from Ollama: {response.text}"
+                )
+            
+            data = response.json()
+            models = []
+            
+            for model_data in data.get("models", []):
+                model = OllamaModelInfo(
+                    name=model_data.get("name"),
+                    modified_at=model_data.get("modified_at"),
+                    size=model_data.get("size"),
+                    digest=model_data.get("digest"),
+                    details=model_data.get("details")
+                )
+                models.append(model)
+            
+            return models
+            
         except httpx.RequestError as e:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -75,6 +114,30 @@ class OllamaService:
         
         return models
     
+    @staticmethod
+    def _to_iso_z(modified_at: Union[datetime, str]) -> str:
+        """
+        ISO 8601 string with a Z suffix: +00:00 becomes Z, a missing timezone gets Z,
+        any other offset is kept as is
+        """
+        if not isinstance(modified_at, str):
+            modified_at = modified_at.isoformat()
+        return _TZ_SUFFIX_RE.sub("Z", modified_at, count=1)
+    
+    @staticmethod
+    def _format_model(model: OllamaModelInfo) -> OllamaAvailableModelInfo:
+        """
+        Format one model like the Java API does
+        """
+        # Extract parameter size if available in details
+        parameter_size = model.details.get('parameter_size') if model.details else None
+        return OllamaAvailableModelInfo(
+            name=model.name,
+            displayName=model.name.replace(":", " "),  # Format display name like in Java
+            size=parameter_size or str(model.size) if model.size else None,
+            modified=OllamaService._to_iso_z(model.modified_at) if model.modified_at else None
+        )
+    
     @staticmethod
     async def get_available_models_formatted() -> OllamaAvailableModelsResponse:
         """
@@ -82,46 +145,7 @@ class OllamaService:
         This method formats the response to be identical to what the Java API returns.
         """
         models = await OllamaService.get_available_models()
-        
-        formatted_models = []
-        for model in models:
-            # Format model data to match Java API response
-            # Extract parameter size if available in details
-            parameter_size = None
-            if model.details and 'parameter_size' in model.details:
-                parameter_size = model.details['parameter_size']
-            
-            # Format modified_at date in ISO format with timezone Z
-            modified_date = None
-            if model.modified_at:
-                if isinstance(model.modified_at, str):
-                    # If already a string, normalize timezone format
-                    if '+00:00' in model.modified_at:
-                        # Replace +00:00 with Z
-                        modified_date = model.modified_at.replace('+00:00', 'Z')
-                    elif 'Z' not in model.modified_at and '+' not in model.modified_at:
-                        # Add Z only if no timezone info exists
-                        modified_date = model.modified_at + 'Z'
-                    else:
-                        # Keep as is if it already has proper format
-                        modified_date = model.modified_at
-                else:
-                    # Convert datetime to ISO format with Z suffix, ensuring no double timezone
-                    iso_format = model.modified_at.isoformat()
-                    if '+00:00' in iso_format:
-                        modified_date = iso_format.replace('+00:00', 'Z')
-                    else:
-                        modified_date = iso_format + 'Z'
-            
-            formatted_model = OllamaAvailableModelInfo(
-                name=model.name,
-                displayName=model.name.replace(":", " "),  # Format display name like in Java
-                size=parameter_size or str(model.size) if model.size else None,
-                modified=modified_date
-            )
-            formatted_models.append(formatted_model)
-        
-        return OllamaAvailableModelsResponse(models=formatted_models)
+        return OllamaAvailableModelsResponse(models=[OllamaService._format_model(model) for model in models])
 
     @staticmethod
     async def pull_model(model_name: str) -> Tuple[bool, str]:
@@ -129,21 +153,20 @@ class OllamaService:
         Pull a model from Ollama API
         """
         try:
-            async with httpx.AsyncClient(timeout=settings.OLLAMA_API_TIMEOUT * 6) as client:  # Longer timeout for model pulls
-                logger.info(f"Pulling model {model_name} from Ollama...")
-                response = await client.post(
-                    f"{settings.OLLAMA_API_URL}/pull",
-                    json={"name": model_name},
-                    timeout=None  # Disable timeout as model pulls can take a while
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"Error pulling model from Ollama: {response.text}")
-                    return False, f"Error pulling model: {response.text}"
-                
-                logger.info(f"Successfully pulled model {model_name}")
-                return True, "Model pulled successfully"
-                
+            logger.info(f"Pulling model {model_name} from Ollama...")
+            response = await OllamaService.get_client().post(
+                "/pull",
+                json={"name": model_name},
+                timeout=None  # Disable timeout as model pulls can take a while
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"Error pulling model from Ollama: {response.text}")
+                return False, f"Error pulling model: {response.text}"
+            
+            logger.info(f"Successfully pulled model {model_name}")
+            return True, "Model pulled successfully"
+            
         except Exception as e:
             error_msg = f"Could not pull model from Ollama: {str(e)}"
             logger.error(error_msg)
@@ -155,38 +178,37 @@ class OllamaService:
         Get detailed information about a specific model
         """
         try:
-            async with httpx.AsyncClient(timeout=settings.OLLAMA_API_TIMEOUT) as client:
-                response = await client.post(
-                    f"{settings.OLLAMA_API_URL}/show",
-                    json={"name": model_name}
-                )
-                
-                if response.status_code != 200:
-                    # If model not found, try to pull the default model
-                    if model_name == OllamaService.DEFAULT_MODEL:
-                        logger.info(f"Default model {model_name} not found. Attempting to pull it...")
-                        success, message = await OllamaService.pull_model(model_name)
-                        if success:
-                            # Try to get info again after pulling
-                            return await OllamaService.get_model_info(model_name)
-                    
-                    raise HTTPException(
-                        status_code=status.HTTP_502_BAD_GATEWAY,
-                        detail=f"Error fetching model info from Ollama: {response.text}"
-                    )
-                
-                model_data = response.json()
+            response = await OllamaService.get_client().post(
+                "/show",
+                json={"name": model_name}
+            )
+            
+            if response.status_code != 200:
+                # If model not found, try to pull the default model
+                if model_name == OllamaService.DEFAULT_MODEL:
+                    logger.info(f"Default model {model_name} not found. Attempting to pull it...")
+                    success, message = await OllamaService.pull_model(model_name)
+                    if success:
+                        # Try to get info again after pulling
+                        return await OllamaService.get_model_info(model_name)
                 
-                model = OllamaModelInfo(
-                    name=model_data.get("name", model_name),
-                    modified_at=None,
-                    size=model_data.get("size"),
-                    digest=model_data.get("digest"),
-                    details=model_data.get("details")
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"Error fetching model info from Ollama: {response.text}"
                 )
-                
-                return model
-                
+            
+            model_data = response.json()
+            
+            model = OllamaModelInfo(
+                name=model_data.get("name", model_name),
+                modified_at=None,
+                size=model_data.get("size"),
+                digest=model_data.get("digest"),
+                details=model_data.get("details")
+            )
+            
+            return model
+            
         except httpx.RequestError as e:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -199,20 +221,20 @@ class OllamaService:
         Delete a model from Ollama
         """
         try:
-            async with httpx.AsyncClient(timeout=settings.OLLAMA_API_TIMEOUT) as client:
-                response = await client.delete(
-                    f"{settings.OLLAMA_API_URL}/delete",
-                    json={"name": model_name}
+            response = await OllamaService.get_client().request(
+                "DELETE",
+                "/delete",
+                json={"name": model_name}
+            )
+            
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"Error deleting model from Ollama: {response.text}"
                 )
-                
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=status.HTTP_502_BAD_GATEWAY,
-                        detail=f"Error deleting model from Ollama: {response.text}"
-                    )
-                
-                return True
-                
+            
+            return True
+            
         except httpx.RequestError as e:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -225,26 +247,69 @@ class OllamaService:
         Copy a model in Ollama
         """
         try:
-            async with httpx.AsyncClient(timeout=settings.OLLAMA_API_TIMEOUT) as client:
-                response = await client.post(
-                    f"{settings.OLLAMA_API_URL}/copy",
-                    json={"source": source, "destination": destination}
+            response = await OllamaService.get_client().post(
+                "/copy",
+                json={"source": source, "destination": destination}
+            )
+            
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"Error copying model in Ollama: {response.text}"
                 )
-                
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=status.HTTP_502_BAD_GATEWAY,
-                        detail=f"Error copying model in Ollama: {response.text}"
-                    )
-                
-                return True
-                
+            
+            return True
+            
         except httpx.RequestError as e:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail=f"Could not connect to Ollama API: {str(e)}"
             )
     
+    @staticmethod
+    async def warm_up(model_name: str):
+        """
+        Load a model into Ollama's memory ahead of the first request.
+        A generate call without a prompt only loads the model; keep_alive keeps it resident.
+        """
+        try:
+            response = await OllamaService.get_client().post(
+                "/generate",
+                json={"model": model_name, "keep_alive": settings.OLLAMA_KEEP_ALIVE},
+                # Loading a model into (V)RAM can take a while, but not forever
+                timeout=settings.OLLAMA_WARM_UP_TIMEOUT
+            )
+            if response.status_code != 200:
+                logger.warning(f"Could not warm up model {model_name}: {response.text}")
+                return
+            logger.info(f"Model {model_name} loaded in Ollama")
+        except httpx.TimeoutException:
+            logger.warning(f"Warm-up of model {model_name} timed out after {settings.OLLAMA_WARM_UP_TIMEOUT}s; "
+                           f"it will load on first use")
+        except httpx.RequestError as e:
+            logger.warning(f"Could not warm up model {model_name}: {str(e)}")
+    
+    @staticmethod
+    @asynccontextmanager
+    async def generate_stream(url: str, payload: Dict[str, Any], timeout: Optional[float] = None
+                              ) -> AsyncGenerator[httpx.Response, None]:
+        """
+        Streamed /generate call holding one of the OLLAMA_NUM_PARALLEL completion slots
+        until the response is closed (url may be absolute, e.g. the RAG endpoint)
+        """
+        async with OllamaService._parallel_sem, OllamaService.get_client().stream(
+            "POST", url, json=payload, timeout=timeout
+        ) as response:
+            yield response
+    
+    @staticmethod
+    async def generate(url: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> httpx.Response:
+        """
+        Non-streamed /generate call, bounded by the same completion slots as chat_completion
+        """
+        async with OllamaService._parallel_sem:
+            return await OllamaService.get_client().post(url, json=payload, timeout=timeout)
+    
     @staticmethod
     async def chat_completion(request: OllamaChatCompletionRequest) -> AsyncGenerator[str, None]:
         """
@@ -254,6 +319,7 @@ class OllamaService:
             "model": request.model,
             "messages": request.messages,
             "stream": request.stream,
+            "keep_alive": settings.OLLAMA_KEEP_ALIVE,
             "options": {
                 "temperature": request.temperature,
                 "top_p": request.top_p,
@@ -262,36 +328,64 @@ class OllamaService:
             }
         }
         
+        # With temperature 0 the same model/messages/options always give the same answer
+        cache_key = None
+        if request.temperature == 0 and settings.OLLAMA_EXACT_CACHE_SIZE > 0:
+            cache_key = hashlib.sha256(orjson.dumps(
+                {"model": payload["model"], "messages": payload["messages"], "options": payload["options"]},
+                option=orjson.OPT_SORT_KEYS
+            )).hexdigest()
+            cached = OllamaService._exact_cache.get(cache_key)
+            if cached is not None:
+                OllamaService._exact_cache.move_to_end(cache_key)
+                yield cached
+                return
+        chunks = []
+        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{settings.OLLAMA_API_URL}/chat",
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=settings.OLLAMA_API_TIMEOUT)
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise HTTPException(
-                            status_code=status.HTTP_502_BAD_GATEWAY,
-                            detail=f"Error from Ollama API: {error_text}"
-                        )
+            async with OllamaService._parallel_sem, OllamaService.get_client().stream("POST", "/chat", json=payload) as response:
+                if response.status_code != 200:
+                    error_text = (await response.aread()).decode(errors="replace")
+                    raise HTTPException(
+                        status_code=status.HTTP_502_BAD_GATEWAY,
+                        detail=f"Error from Ollama API: {error_text}"
+                    )
+                
+                # Process streaming response
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
                     
-                    # Process streaming response
-                    async for line in response.content:
-                        if not line:
-                            continue
-                        
-                        try:
-                            line_data = json.loads(line)
-                            if "message" in line_data and "content" in line_data["message"]:
-                                content = line_data["message"]["content"]
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError:
-                            continue
+                    try:
+                        line_data = orjson.loads(line)
+                        if "message" in line_data and "content" in line_data["message"]:
+                            content = line_data["message"]["content"]
+                            if content:
+                                if cache_key is not None:
+                                    chunks.append(content)
+                                yield content
+                    except orjson.JSONDecodeError:
+                        continue
+            
+            # Only complete responses are cached
+            if cache_key is not None:
+                OllamaService._exact_cache[cache_key] = "".join(chunks)
+                while len(OllamaService._exact_cache) > settings.OLLAMA_EXACT_CACHE_SIZE:
+                    OllamaService._exact_cache.popitem(last=False)
         
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        except httpx.RequestError as e:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail=f"Could not connect to Ollama API: {str(e)}"
-            )
\ No newline at end of file
+            )
+    
+    @staticmethod
+    async def chat_completion_many(requests: List[OllamaChatCompletionRequest]) -> List[str]:
+        """
+        Run several chat completions concurrently and return their full texts in order,
+        so Ollama can batch them across its parallel slots (up to OLLAMA_NUM_PARALLEL at once)
+        """
+        async def collect(request: OllamaChatCompletionRequest) -> str:
+            return "".join([chunk async for chunk in OllamaService.chat_completion(request)])
+        
+        return list(await asyncio.gather(*(collect(request) for request in requests)))
@@ -1,25 +1,32 @@
-import json
+import asyncio
 import os
 import pickle
-import re
 import logging
+import threading
 import time
+import uuid
+from collections import Counter
+from cachetools import LRUCache
 import numpy as np
-import requests
+import httpx
 import faiss
+import ijson
+import orjson
+import torch
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Tuple, Any, Optional
+from typing import List, Dict, Tuple, Any, Optional, Iterator, AsyncIterator
 
 # Thêm các thư viện LangChain
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.embeddings.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS as LangchainFAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 
 from langchain.docstore.document import Document
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain_ollama import OllamaLLM
+
+from app.core.config import settings
+from app.services.ollama_service import OllamaService
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -31,10 +38,54 @@ FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "app/data/faiss_index.pkl")
 METADATA_PATH = os.getenv("METADATA_PATH", "app/data/metadata.pkl")
 # Update embedding model to use E5-Mistral-7B-Instruct
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "intfloat/e5-mistral-7b-instruct")
-OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://ollama:11434/api/generate")
+# External embedding server (e.g. michaelfeil/infinity); when set, no model is loaded in-process
+EMBEDDING_URL = os.getenv("EMBEDDING_URL")
+EMBEDDING_TIMEOUT = int(os.getenv("EMBEDDING_TIMEOUT", "60"))
+# In-process embedding model runs on the GPU when there is one, in half precision there
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+EMBEDDING_FP16 = EMBEDDING_DEVICE.startswith("cuda") and os.getenv("EMBEDDING_FP16", "true").lower() == "true"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64" if EMBEDDING_DEVICE.startswith("cuda") else "8"))
+# Larger batches when embedding the whole corpus for an index build
+INDEX_EMBEDDING_BATCH_SIZE = int(os.getenv("INDEX_EMBEDDING_BATCH_SIZE", "128"))
+# PyTorch intra-op threads for CPU encoding (all cores, the model parallelizes each batch)
+EMBEDDING_NUM_THREADS = int(os.getenv("EMBEDDING_NUM_THREADS", str(os.cpu_count() or 1)))
+# Without a GPU, small encoders run as a dynamically INT8-quantized ONNX model on onnxruntime
+# (E5-Mistral-7B is too large for a single ONNX file and stays on PyTorch)
+EMBEDDING_ONNX_INT8 = os.getenv(
+    "EMBEDDING_ONNX_INT8", "true" if EMBEDDING_DEVICE == "cpu" else "false"
+).lower() == "true" and "e5-mistral" not in EMBEDDING_MODEL.lower()
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "app/data/onnx")
 OLLAMA_API_BASE = os.getenv("OLLAMA_API_BASE", "http://ollama:11434")
+OLLAMA_GENERATE_URL = f"{OLLAMA_API_BASE.rstrip('/')}/api/generate"
 LLM_MODEL = os.getenv("LLM_MODEL", "llama3.1:8b")
+# Keep the model (and its prompt KV cache) loaded between requests (parsed in settings)
+OLLAMA_KEEP_ALIVE = settings.OLLAMA_KEEP_ALIVE
+OLLAMA_GENERATE_TIMEOUT = int(os.getenv("OLLAMA_GENERATE_TIMEOUT", "120"))
 TOP_K = int(os.getenv("TOP_K", "5"))
+# FAISS index type: "sq8" (int8 codes), "ivfpq", "hnsw" (graph search over FP32 vectors)
+# or "flat" (brute-force IndexFlatL2)
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "sq8")
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+# IVF lists; 0 picks 4 * sqrt(N), capped so every list still gets enough training points
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+# Compressed indexes fetch k * FAISS_RERANK_FACTOR candidates, reranked with the FP32 vectors
+FAISS_RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", "4"))
+# Keep the rerank vectors in FP16: half the memory/disk, and ~3 significant digits of
+# normalized components are plenty to order a few dozen candidates
+FAISS_RERANK_FP16 = os.getenv("FAISS_RERANK_FP16", "true").lower() == "true"
+FAISS_VECTORS_FILE = "vectors.npy"
+# Concurrent /rag/chat queries are embedded together: up to this many, waiting at most this long
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_MAX_WAIT_MS = int(os.getenv("EMBED_MAX_WAIT_MS", "10"))
+# Embeddings of recent query texts, reused when the same question comes again (0 disables)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+# How long /rag/status trusts its last check of the saved index on disk
+INDEX_SAVED_CACHE_TTL = 5.0
 
 # Define the task description for search instruction
 SEARCH_INSTRUCTION = "Tìm kiếm các thông tin pháp luật về giao thông đường bộ"
@@ -61,53 +112,181 @@ class E5MistralEmbeddings(Embeddings):
     def __init__(self):
         """Initialize the embedding model"""
         self.model_name = EMBEDDING_MODEL
-        self.sentence_transformer = SentenceTransformer(EMBEDDING_MODEL)
+        self.sentence_transformer = SentenceTransformer(EMBEDDING_MODEL, device=EMBEDDING_DEVICE)
+        if EMBEDDING_FP16:
+            self.sentence_transformer.half()
         self.sentence_transformer.max_seq_length = 512
-        logger.info(f"Initialized E5MistralEmbeddings with model: {self.model_name}")
+        # Instruction prepended to every query, built once
+        self.query_prefix = f"Instruct: {SEARCH_INSTRUCTION}\nQuery: "
+        logger.info(f"Initialized E5MistralEmbeddings with model: {self.model_name} on {EMBEDDING_DEVICE}"
+                    f"{' (fp16)' if EMBEDDING_FP16 else ''}")
+    
+    def encode(self, texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        """Encode texts into normalized float32 vectors; sentence-transformers batches internally"""
+        return self.sentence_transformer.encode(
+            texts,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ).astype(np.float32, copy=False)
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Embed a list of documents"""
         try:
-            embeddings = []
-            batch_size = 8  # Small batch size to manage memory
-            
-            # Process in batches
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i+batch_size]
-                batch_embeddings = self.sentence_transformer.encode(
-                    batch, 
-                    normalize_embeddings=True,
-                    show_progress_bar=False
-                )
-                # Convert numpy arrays to lists
-                if isinstance(batch_embeddings, np.ndarray):
-                    batch_embeddings = batch_embeddings.tolist()
-                embeddings.extend(batch_embeddings)
-            
-            return embeddings
+            return self.encode(texts).tolist()
         except Exception as e:
             logger.error(f"Error in embed_documents: {str(e)}")
             raise
     
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one pass, with the instruction format the model expects"""
+        return self.embed_documents([self.query_prefix + text for text in texts])
+    
     def embed_query(self, text: str) -> List[float]:
         """Embed a query with proper instruction format"""
         try:
-            # Format the query with instruction as required by the model
-            instructed_query = f"Instruct: {SEARCH_INSTRUCTION}\nQuery: {text}"
-            embedding = self.sentence_transformer.encode(
-                instructed_query, 
-                normalize_embeddings=True,
-                show_progress_bar=False
-            )
-            # Convert to list if it's a numpy array
-            if isinstance(embedding, np.ndarray):
-                embedding = embedding.tolist()
-            return embedding
+            return self.embed_queries([text])[0]
         except Exception as e:
             logger.error(f"Error in embed_query: {str(e)}")
             raise
 
+class InfinityEmbeddings(Embeddings):
+    """Embeddings computed by an external Infinity server through its OpenAI-compatible /embeddings API"""
+    
+    def __init__(self, base_url: str, model_name: str = EMBEDDING_MODEL):
+        """Initialize the HTTP client for the embedding server"""
+        self.base_url = base_url.rstrip("/")
+        self.model_name = model_name
+        # One pooled client, so embedding calls reuse connections
+        self.client = httpx.Client(timeout=EMBEDDING_TIMEOUT)
+        # E5 models expect the search instruction on queries
+        self.query_prefix = f"Instruct: {SEARCH_INSTRUCTION}\nQuery: " if "e5-mistral" in model_name.lower() else ""
+        logger.info(f"Using embedding server {self.base_url} with model: {self.model_name}")
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents in one request; the server batches internally"""
+        try:
+            response = self.client.post(
+                f"{self.base_url}/embeddings",
+                json={"input": texts, "model": self.model_name}
+            )
+            response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+            return [item["embedding"] for item in data]
+        except Exception as e:
+            logger.error(f"Error in embed_documents: {str(e)}")
+            raise
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one request"""
+        return self.embed_documents([self.query_prefix + text for text in texts])
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query with proper instruction format"""
+        return self.embed_queries([text])[0]
+
+class OnnxInt8Embeddings(Embeddings):
+    """
+    Sentence-transformers encoder exported to ONNX and dynamically quantized to INT8,
+    run on the onnxruntime CPU provider with mean pooling + L2 normalization in NumPy
+    """
+    
+    def __init__(self, model_name: str = EMBEDDING_MODEL, cache_dir: str = EMBEDDING_ONNX_DIR):
+        """Export and quantize the model on first use, then open an inference session"""
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        
+        self.model_name = model_name
+        model_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        quantized_path = os.path.join(model_dir, "model.int8.onnx")
+        if not os.path.exists(quantized_path):
+            self.export_quantized(model_name, model_dir, quantized_path)
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ort.InferenceSession(quantized_path, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        logger.info(f"Initialized OnnxInt8Embeddings with model: {self.model_name} ({quantized_path})")
+    
+    @staticmethod
+    def export_quantized(model_name: str, model_dir: str, quantized_path: str):
+        """Export the model to ONNX (feature-extraction) and quantize its weights to INT8"""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        from transformers import AutoTokenizer
+        
+        logger.info(f"Exporting {model_name} to ONNX in {model_dir}")
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(model_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+        quantize_dynamic(os.path.join(model_dir, "model.onnx"), quantized_path, weight_type=QuantType.QInt8)
+    
+    def encode(self, texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        """Encode texts into normalized float32 vectors"""
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=512,
+                return_tensors="np"
+            )
+            feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+            token_embeddings = self.session.run(None, feed)[0]
+            
+            # Mean pooling over real tokens, as sentence-transformers does
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            batches.append(pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None))
+        
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(batches).astype(np.float32, copy=False)
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents"""
+        try:
+            return self.encode(texts).tolist()
+        except Exception as e:
+            logger.error(f"Error in embed_documents: {str(e)}")
+            raise
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self.embed_documents([text])[0]
+
+class RerankingFAISS(LangchainFAISS):
+    """
+    LangChain FAISS store that over-fetches from a compressed index and reranks
+    the candidates with exact L2 distances against the original FP32 vectors
+    """
+    full_vectors: Optional[np.ndarray] = None
+    
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None,
+                                               fetch_k: int = 20, **kwargs: Any) -> List[Tuple[Document, float]]:
+        if self.full_vectors is None or filter is not None:
+            return super().similarity_search_with_score_by_vector(
+                embedding, k, filter=filter, fetch_k=fetch_k, **kwargs
+            )
+        
+        query = np.array([embedding], dtype=np.float32)
+        _, indices = self.index.search(query, k * FAISS_RERANK_FACTOR)
+        candidates = indices[0][indices[0] != -1]
+        
+        # Same squared L2 distance IndexFlatL2 would have returned
+        distances = ((self.full_vectors[candidates].astype(np.float32) - query) ** 2).sum(axis=1)
+        
+        results = []
+        for j in np.argsort(distances)[:k]:
+            doc = self.docstore.search(self.index_to_docstore_id[int(candidates[j])])
+            results.append((doc, float(distances[j])))
+        return results
+
 class RAGProcessor:
+    # Loaded embedding models by EMBEDDING_URL/EMBEDDING_MODEL, shared by every processor in the process
+    _embeddings_cache: Dict[str, Embeddings] = {}
+    
     def __init__(self, data_path: str = LAW_DATA_PATH):
         """Initialize the RAG processor with the base path for finding law data"""
         self.data_path = data_path
@@ -115,64 +294,57 @@ class RAGProcessor:
         self.vectorstore = None
         self.documents = []
         self.sentence_transformer_model = None
+        # Retrieval count per chunk, used to put hot chunks first in the prompt
+        self.chunk_hits = Counter()
+        # Number of indexed documents, updated when the vectorstore is built or loaded
+        self.document_count = 0
+        # (checked_at, exists) for the saved index on disk
+        self._index_saved_cache: Optional[Tuple[float, bool]] = None
+        # Query text -> embedding, and (query text, k) -> retrieved chunks for the current index.
+        # Both are used from worker threads, hence the lock
+        self._query_embeddings: LRUCache = LRUCache(maxsize=max(QUERY_EMBEDDING_CACHE_SIZE, 1))
+        self._retrieval_cache: LRUCache = LRUCache(maxsize=max(QUERY_EMBEDDING_CACHE_SIZE, 1))
+        self._cache_lock = threading.Lock()
 
     def clean_text(self, text: str) -> str:
-        """Clean text by removing unnecessary whitespace and special characters"""
-        # Replace \r\n with spaces
-        text = re.sub(r'\r\n', ' ', text)
-        # Remove multiple spaces
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
+        """Clean text by collapsing whitespace (\r\n included) into single spaces"""
+        # str.split() with no separator splits on any whitespace run and drops the ends, in one C pass
+        return " ".join(text.split())
 
-    def load_and_chunk_data(self) -> List[Document]:
+    def iter_chunked_documents(self, json_files: List[str], data_dir: str) -> Iterator[Document]:
         """
-        Load the law data from all JSON files in the data/json directory and chunk it into Langchain Documents
-        Returns:
-            List of Document objects with content and metadata
+        Stream chunked Langchain Documents from the law JSON files.
+        Chapters are parsed one at a time with ijson, so a file is never loaded whole.
         """
-        try:
-            documents = []
-            data_dir = os.path.join(os.path.dirname(self.data_path), "json")
-            
-            # Get all JSON files in the data/json directory
-            json_files = [f for f in os.listdir(data_dir) if f.endswith('.json')]
-            logger.info(f"Found {len(json_files)} JSON files in {data_dir}")
-            
-            # Define text splitter for chunking long texts
-            # Smaller chunk size to ensure it fits within the model's max_seq_length
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=400,  # Smaller chunks to ensure they fit within the 512 token limit
-                chunk_overlap=50,
-                length_function=len,
-            )
+        # Define text splitter for chunking long texts
+        # Smaller chunk size to ensure it fits within the model's max_seq_length
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=400,  # Smaller chunks to ensure they fit within the 512 token limit
+            chunk_overlap=50,
+            length_function=len,
+        )
+        
+        for json_file in json_files:
+            file_path = os.path.join(data_dir, json_file)
+            # Extract file name without extension as source identifier
+            source_name = os.path.splitext(json_file)[0]
+            file_document_count = 0
             
-            for json_file in json_files:
-                file_path = os.path.join(data_dir, json_file)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        law_data = json.load(f)
-                    
-                    # Extract file name without extension as source identifier
-                    source_name = os.path.splitext(json_file)[0]
-                    
-                    file_documents = []
-                    
-                    for chapter in law_data.get("chapters", []):
+            try:
+                with open(file_path, 'rb') as f:
+                    for chapter in ijson.items(f, "chapters.item"):
                         chapter_title = chapter.get("chapter_title", "")
                         
                         for article in chapter.get("articles", []):
                             article_title = article.get("article_title", "")
                             
                             # Combine all content items into a single text
-                            content = ""
-                            for content_item in article.get("content", []):
-                                clean_content = self.clean_text(content_item)
-                                content += clean_content + " "
+                            content = " ".join([self.clean_text(item) for item in article.get("content", [])]).strip()
                             
                             # Skip empty content
-                            if not content.strip():
+                            if not content:
                                 continue
-                                
+                            
                             # Create metadata
                             metadata = {
                                 "source_file": source_name,
@@ -181,34 +353,44 @@ class RAGProcessor:
                                 "source": f"{source_name}: {chapter_title}, {article_title}"
                             }
                             
-                            # Create a document
-                            doc = Document(page_content=content.strip(), metadata=metadata)
-                            file_documents.append(doc)
-                    
-                    # Split documents into chunks if they're too long
-                    chunked_documents = []
-                    for doc in file_documents:
-                        if len(doc.page_content) > 400:  # Only split if longer than our chunk size
-                            chunks = text_splitter.split_text(doc.page_content)
-                            for i, chunk in enumerate(chunks):
-                                # Create a new document for each chunk with the same metadata
-                                chunked_doc = Document(
-                                    page_content=chunk,
-                                    metadata={
-                                        **doc.metadata,
-                                        "chunk": i+1,
-                                        "total_chunks": len(chunks)
-                                    }
-                                )
-                                chunked_documents.append(chunked_doc)
-                        else:
-                            chunked_documents.append(doc)
-                    
-                    documents.extend(chunked_documents)
-                    logger.info(f"Processed {json_file}: added {len(chunked_documents)} documents")
-                except Exception as e:
-                    logger.error(f"Error processing file {json_file}: {str(e)}")
-                    continue
+                            # Split into chunks only if longer than our chunk size
+                            if len(content) > 400:
+                                chunks = text_splitter.split_text(content)
+                                for i, chunk in enumerate(chunks):
+                                    # Create a new document for each chunk with the same metadata
+                                    yield Document(
+                                        page_content=chunk,
+                                        metadata={
+                                            **metadata,
+                                            "chunk": i+1,
+                                            "total_chunks": len(chunks)
+                                        }
+                                    )
+                                file_document_count += len(chunks)
+                            else:
+                                yield Document(page_content=content, metadata=metadata)
+                                file_document_count += 1
+                
+                logger.info(f"Processed {json_file}: added {file_document_count} documents")
+            except Exception as e:
+                logger.error(f"Error processing file {json_file}: {str(e)}")
+                continue
+
+    def load_and_chunk_data(self) -> List[Document]:
+        """
+        Load the law data from all JSON files in the data/json directory and chunk it into Langchain Documents
+        Returns:
+            List of Document objects with content and metadata
+        """
+        try:
+            data_dir = os.path.join(os.path.dirname(self.data_path), "json")
+            
+            # Get all JSON files in the data/json directory
+            json_files = [f for f in os.listdir(data_dir) if f.endswith('.json')]
+            logger.info(f"Found {len(json_files)} JSON files in {data_dir}")
+            
+            # The docstore keeps every document anyway, so materialize the chunks (not the JSON)
+            documents = list(self.iter_chunked_documents(json_files, data_dir))
             
             logger.info(f"Total loaded and chunked data: {len(documents)} documents created from {len(json_files)} files")
             return documents
@@ -218,28 +400,88 @@ class RAGProcessor:
             raise
 
     def initialize_embeddings(self):
-        """Initialize embeddings for Langchain"""
+        """Initialize embeddings for Langchain, reusing a model already loaded in this process"""
+        cache_key = EMBEDDING_URL or EMBEDDING_MODEL
+        cached = RAGProcessor._embeddings_cache.get(cache_key)
+        if cached is not None:
+            self.embeddings = cached
+            return
+        
         try:
+            if EMBEDDING_URL:
+                # Inference runs on the embedding server, not in the API process
+                self.embeddings = InfinityEmbeddings(EMBEDDING_URL)
+                RAGProcessor._embeddings_cache[cache_key] = self.embeddings
+                return
+            
             logger.info(f"Loading embedding model: {EMBEDDING_MODEL}")
             
+            if EMBEDDING_DEVICE == "cpu":
+                torch.set_num_threads(EMBEDDING_NUM_THREADS)
+                try:
+                    torch.set_num_interop_threads(2)
+                except RuntimeError:
+                    # Only allowed before the first inter-op parallel work in the process
+                    pass
+            
             # For E5-Mistral-7B model, use our dedicated class
             if "e5-mistral" in EMBEDDING_MODEL.lower():
                 self.embeddings = E5MistralEmbeddings()
+            elif EMBEDDING_ONNX_INT8:
+                self.embeddings = OnnxInt8Embeddings()
             else:
                 # Fallback to regular HuggingFaceEmbeddings for other models
-                model_kwargs = {'device': 'cpu'}
-                encode_kwargs = {'normalize_embeddings': True}
+                model_kwargs = {'device': EMBEDDING_DEVICE}
+                encode_kwargs = {'normalize_embeddings': True, 'batch_size': EMBEDDING_BATCH_SIZE}
                 self.embeddings = HuggingFaceEmbeddings(
                     model_name=EMBEDDING_MODEL,
                     model_kwargs=model_kwargs,
                     encode_kwargs=encode_kwargs
                 )
-                
+                if EMBEDDING_FP16:
+                    self.embeddings.client.half()
+            
+            RAGProcessor._embeddings_cache[cache_key] = self.embeddings
             logger.info("Embedding model loaded successfully")
         except Exception as e:
             logger.error(f"Error loading embedding model: {str(e)}")
             raise
 
+    @staticmethod
+    def query_key(query: str) -> str:
+        """Cache key of a query: the text with whitespace collapsed (case kept, the models are cased)"""
+        return " ".join(query.split())
+    
+    def embed_batch(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embed a batch of user queries in a single forward pass per model batch.
+        Queries embedded recently come from the cache; only the rest go through the model.
+        """
+        if self.embeddings is None:
+            self.initialize_embeddings()
+        
+        keys = [self.query_key(query) for query in queries]
+        with self._cache_lock:
+            vectors = {key: self._query_embeddings.get(key) for key in keys}
+        missing = [key for key, vector in vectors.items() if vector is None]
+        
+        if missing:
+            if isinstance(self.embeddings, (E5MistralEmbeddings, InfinityEmbeddings)):
+                embedded = self.embeddings.embed_queries(missing)
+            else:
+                embedded = self.embeddings.embed_documents(missing)
+            vectors.update(zip(missing, embedded))
+            
+            if QUERY_EMBEDDING_CACHE_SIZE > 0:
+                with self._cache_lock:
+                    self._query_embeddings.update(zip(missing, embedded))
+        
+        return [vectors[key] for key in keys]
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Embed one user query (cached like embed_batch)"""
+        return self.embed_batch([query])[0]
+
     def build_vectorstore(self, documents: List[Document]):
         """
         Build a FAISS vectorstore using Langchain
@@ -257,35 +499,151 @@ class RAGProcessor:
                 
             logger.info(f"Building vectorstore with {len(documents)} documents")
             
-            # Process in batches to prevent memory issues with large document sets
-            batch_size = 50  # Adjust based on memory constraints
-            all_batches = []
+            # Embed the whole corpus in one call (the model batches internally)
+            texts = [doc.page_content for doc in documents]
+            if isinstance(self.embeddings, (E5MistralEmbeddings, OnnxInt8Embeddings)):
+                vectors = self.embeddings.encode(texts, batch_size=INDEX_EMBEDDING_BATCH_SIZE)
+            elif isinstance(self.embeddings, HuggingFaceEmbeddings):
+                # Straight to the SentenceTransformer: one numpy array, no per-vector lists
+                vectors = self.embeddings.client.encode(
+                    texts,
+                    batch_size=INDEX_EMBEDDING_BATCH_SIZE,
+                    normalize_embeddings=True,
+                    convert_to_numpy=True,
+                    show_progress_bar=False
+                ).astype(np.float32, copy=False)
+            else:
+                vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+            
+            # One flat index filled straight from the array (from_embeddings would need the
+            # vectors as Python lists); compress_index swaps it for the configured index type
+            index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+            ids = [str(uuid.uuid4()) for _ in documents]
             
-            for i in range(0, len(documents), batch_size):
-                end_idx = min(i + batch_size, len(documents))
-                batch = documents[i:end_idx]
-                logger.info(f"Processing batch {i//batch_size + 1}/{(len(documents)-1)//batch_size + 1} ({len(batch)} documents)")
-                
-                # Create a small vectorstore for this batch
-                batch_vectorstore = LangchainFAISS.from_documents(
-                    documents=batch,
-                    embedding=self.embeddings
-                )
-                all_batches.append(batch_vectorstore)
+            with self._cache_lock:
+                self._retrieval_cache.clear()
+            self.vectorstore = RerankingFAISS(
+                embedding_function=self.embeddings,
+                index=index,
+                docstore=InMemoryDocstore(dict(zip(ids, documents))),
+                index_to_docstore_id=dict(enumerate(ids))
+            )
             
-            # Merge all batch vectorstores if there are multiple batches
-            if len(all_batches) > 1:
-                self.vectorstore = all_batches[0]
-                for batch_vs in all_batches[1:]:
-                    self.vectorstore.merge_from(batch_vs)
-            else:
-                self.vectorstore = all_batches[0]
+            self.compress_index()
                 
+            self.document_count = len(documents)
             logger.info(f"Built FAISS vectorstore with {len(documents)} documents")
         except Exception as e:
             logger.error(f"Error building vectorstore: {str(e)}")
             raise
 
+    def compress_index(self):
+        """
+        Replace the brute-force IndexFlatL2 built by LangChain with an int8 scalar-quantized,
+        IVF-PQ or HNSW index. Vectors are re-added in the same order, so index_to_docstore_id
+        stays valid, and for the quantized indexes the FP32 vectors are kept for reranking.
+        Embeddings are normalized, so L2 order is the same as cosine / inner product order.
+        """
+        if FAISS_INDEX_TYPE not in ("sq8", "ivfpq", "hnsw"):
+            return
+        
+        flat_index = self.vectorstore.index
+        ntotal, d = flat_index.ntotal, flat_index.d
+        vectors = flat_index.reconstruct_n(0, ntotal)
+        
+        if FAISS_INDEX_TYPE == "hnsw":
+            # Sublinear graph search with exact FP32 distances, so no training and no rerank
+            index = faiss.IndexHNSWFlat(d, FAISS_HNSW_M, faiss.METRIC_L2)
+            index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+            index.add(vectors)
+            
+            self.vectorstore.index = index
+            self.configure_index()
+            logger.info(f"Rebuilt FAISS index as HNSW (M={FAISS_HNSW_M}, efConstruction={FAISS_HNSW_EF_CONSTRUCTION})")
+            return
+        
+        if FAISS_INDEX_TYPE == "sq8":
+            # Per-dimension min/max trained by faiss, 1 byte per component
+            index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+            index.train(vectors)
+            index.add(vectors)
+            
+            self.vectorstore.index = index
+            self.vectorstore.full_vectors = self.rerank_vectors(vectors)
+            logger.info(f"Compressed FAISS index to int8 scalar quantization ({index.code_size} bytes/vector)")
+            return
+        
+        # faiss wants ~39 training points per PQ centroid; smaller corpora stay flat
+        min_vectors = 39 * (1 << FAISS_PQ_NBITS)
+        if ntotal < min_vectors:
+            logger.info(f"Keeping flat index: {ntotal} vectors is below the {min_vectors} needed to train IVF-PQ")
+            return
+        if d % FAISS_PQ_M != 0:
+            logger.warning(f"Keeping flat index: dimension {d} is not divisible by FAISS_PQ_M={FAISS_PQ_M}")
+            return
+        
+        nlist = FAISS_NLIST or max(1, min(int(4 * np.sqrt(ntotal)), ntotal // 39))
+        
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, FAISS_PQ_M, FAISS_PQ_NBITS)
+        index.train(vectors)
+        index.add(vectors)
+        
+        self.vectorstore.index = index
+        self.vectorstore.full_vectors = self.rerank_vectors(vectors)
+        self.configure_index()
+        logger.info(f"Compressed FAISS index to IVF-PQ (nlist={nlist}, M={FAISS_PQ_M}, nbits={FAISS_PQ_NBITS}, "
+                    f"nprobe={FAISS_NPROBE})")
+    
+    @staticmethod
+    def rerank_vectors(vectors: np.ndarray) -> np.ndarray:
+        """Copy of the original vectors kept for reranking, in FP16 unless FAISS_RERANK_FP16 is off"""
+        return vectors.astype(np.float16) if FAISS_RERANK_FP16 else vectors
+    
+    def configure_index(self):
+        """Apply query-time parameters to the loaded index"""
+        index = self.vectorstore.index
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+            return
+        
+        ivf_index = faiss.try_extract_index_ivf(index)
+        if ivf_index is not None:
+            ivf_index.nprobe = FAISS_NPROBE
+    
+    def is_index_saved(self) -> bool:
+        """Whether the index exists on disk, re-checked at most every INDEX_SAVED_CACHE_TTL seconds"""
+        now = time.monotonic()
+        if self._index_saved_cache is None or now - self._index_saved_cache[0] > INDEX_SAVED_CACHE_TTL:
+            self._index_saved_cache = (now, os.path.exists(FAISS_INDEX_PATH))
+        return self._index_saved_cache[1]
+    
+    def get_quantization_info(self) -> Dict[str, Any]:
+        """Describe the loaded index compression for /rag/status"""
+        if self.vectorstore is None:
+            return {}
+        
+        index = self.vectorstore.index
+        info = {
+            "index_type": type(index).__name__,
+            "vector_count": index.ntotal,
+            "dimension": index.d,
+            "bytes_per_vector": getattr(index, "code_size", index.d * 4),
+            "fp32_rerank": self.vectorstore.full_vectors is not None,
+            "rerank_dtype": str(self.vectorstore.full_vectors.dtype) if self.vectorstore.full_vectors is not None else None,
+            "rerank_factor": FAISS_RERANK_FACTOR,
+        }
+        
+        if isinstance(index, faiss.IndexScalarQuantizer):
+            # trained = per-dimension [vmin..., vdiff...], i.e. zero points and ranges
+            trained = faiss.vector_to_array(index.sq.trained)
+            info["zeros_range"] = [float(trained[:index.d].min()), float(trained[:index.d].max())]
+            info["scales_range"] = [float(trained[index.d:].min() / 255), float(trained[index.d:].max() / 255)]
+        
+        return info
+    
+    
     def save_vectorstore(self):
         """Save the vectorstore to disk"""
         try:
@@ -294,11 +652,29 @@ class RAGProcessor:
             
             # Save vectorstore
             self.vectorstore.save_local(FAISS_INDEX_PATH)
+            
+            # FP32 sidecar used to rerank candidates from the compressed index; indexes with
+            # exact distances (flat, HNSW) must not pick up one left by an earlier build
+            vectors_path = os.path.join(FAISS_INDEX_PATH, FAISS_VECTORS_FILE)
+            if self.vectorstore.full_vectors is not None:
+                np.save(vectors_path, self.vectorstore.full_vectors)
+            elif os.path.exists(vectors_path):
+                os.remove(vectors_path)
+            self._index_saved_cache = None
             logger.info(f"Saved vectorstore to {FAISS_INDEX_PATH}")
         except Exception as e:
             logger.error(f"Error saving vectorstore: {str(e)}")
             raise
 
+    @staticmethod
+    def read_index(path: str) -> faiss.Index:
+        """Read a FAISS index memory-mapped, or fully into RAM for index types faiss cannot mmap"""
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.info(f"Index can't be memory-mapped, reading it into memory: {str(e)}")
+            return faiss.read_index(path)
+
     def load_vectorstore(self) -> bool:
         """
         Load the vectorstore from disk
@@ -314,13 +690,28 @@ class RAGProcessor:
             if self.embeddings is None:
                 self.initialize_embeddings()
                 
-            # Load vectorstore
-            self.vectorstore = LangchainFAISS.load_local(
-                FAISS_INDEX_PATH,
-                self.embeddings,
-                allow_dangerous_deserialization=True
+            # Load vectorstore: the same index.faiss / index.pkl pair save_local writes, but the
+            # index is memory-mapped read-only, so its pages are loaded on demand and shared
+            # between worker processes instead of copied into each one
+            index = self.read_index(os.path.join(FAISS_INDEX_PATH, "index.faiss"))
+            with open(os.path.join(FAISS_INDEX_PATH, "index.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            with self._cache_lock:
+                self._retrieval_cache.clear()
+            self.vectorstore = RerankingFAISS(
+                embedding_function=self.embeddings,
+                index=index,
+                docstore=docstore,
+                index_to_docstore_id=index_to_docstore_id
             )
+            self.configure_index()
+            
+            # Memory-map the FP32 sidecar so reranking only pages in the candidate rows
+            vectors_path = os.path.join(FAISS_INDEX_PATH, FAISS_VECTORS_FILE)
+            if not isinstance(self.vectorstore.index, faiss.IndexFlat) and os.path.exists(vectors_path):
+                self.vectorstore.full_vectors = np.load(vectors_path, mmap_mode="r")
             
+            self.document_count = self.vectorstore.index.ntotal
             logger.info(f"Loaded vectorstore successfully")
             return True
         except Exception as e:
@@ -391,8 +782,7 @@ class RAGProcessor:
                 self.build_or_load_vectorstore()
             
             # Search vectorstore
-            retriever = self.vectorstore.as_retriever(search_kwargs={"k": top_k})
-            docs = retriever.invoke(query)
+            docs = self.retrieve(query, k=top_k)
             
             # Format results
             results = []
@@ -421,106 +811,192 @@ class RAGProcessor:
         
         return "\n\n".join(context_parts)
 
-    def create_chain(self):
+    @staticmethod
+    def chunk_key(doc: Document) -> str:
+        """Stable identifier of a retrieved chunk"""
+        return f"{doc.metadata.get('source', '')}#{doc.metadata.get('chunk', 0)}"
+    
+    def order_for_prefix_cache(self, docs: List[Document]) -> List[Document]:
         """
-        Create a RetrievalQA chain with the vectorstore and Ollama
+        Order retrieved chunks by how often they have been retrieved.
+        The prompt is instructions, then context, then the question, so putting frequently
+        retrieved chunks first makes consecutive prompts share a longer prefix, and the LLM
+        server (Ollama prompt cache / vLLM prefix caching) can reuse the KV state for it.
         """
-        try:
-            # Configure Ollama LLM
-            llm = OllamaLLM(model=LLM_MODEL, base_url=OLLAMA_API_BASE)
-            
-            # Create prompt template
-            prompt = PromptTemplate(
-                template=PROMPT_TEMPLATE,
-                input_variables=["context", "question"]
-            )
-            
-            # Create retriever if needed
-            if self.vectorstore is None:
-                self.build_or_load_vectorstore()
-                
-            retriever = self.vectorstore.as_retriever(search_kwargs={"k": TOP_K})
-            
-            # Create chain
-            chain = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=retriever,
-                return_source_documents=True,
-                chain_type_kwargs={"prompt": prompt}
-            )
+        self.chunk_hits.update(self.chunk_key(doc) for doc in docs)
+        # sorted() is stable, so ties keep the relevance order
+        return sorted(docs, key=lambda doc: -self.chunk_hits[self.chunk_key(doc)])
+    
+    def retrieve(self, query: str, query_embedding: Optional[List[float]] = None, k: int = TOP_K) -> List[Document]:
+        """
+        Retrieve the top k chunks for a query, using the precomputed embedding if given.
+        Repeated questions are answered from the cache until the index is rebuilt or reloaded.
+        """
+        if self.vectorstore is None:
+            self.build_or_load_vectorstore()
+        
+        cache_key = (self.query_key(query), k)
+        with self._cache_lock:
+            docs = self._retrieval_cache.get(cache_key)
+        if docs is not None:
+            return docs
+        
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        docs = self.vectorstore.similarity_search_by_vector(query_embedding, k=k)
+        
+        if QUERY_EMBEDDING_CACHE_SIZE > 0:
+            with self._cache_lock:
+                self._retrieval_cache[cache_key] = docs
+        return docs
+    
+    @staticmethod
+    def format_sources(docs: List[Document]) -> List[Dict[str, Any]]:
+        """Format source documents for the API response"""
+        return [
+            {
+                "chapter_title": doc.metadata.get("chapter_title", ""),
+                "article_title": doc.metadata.get("article_title", ""),
+                "content": doc.page_content
+            }
+            for doc in docs
+        ]
+    
+    def build_prompt(self, query: str, source_docs: List[Document]) -> str:
+        """Same prompt the "stuff" chain builds: chunks joined by blank lines, hot chunks first"""
+        context = "\n\n".join(doc.page_content for doc in self.order_for_prefix_cache(source_docs))
+        return PROMPT_TEMPLATE.format(context=context, question=query)
+    
+    async def generate_answer_stream(self, query: str, query_embedding: Optional[List[float]] = None
+                                     ) -> AsyncIterator[Tuple[Optional[str], Optional[List[Dict[str, Any]]]]]:
+        """
+        Stream the answer to the user's query
+        Yields (None, sources) once, as soon as retrieval is done, then (token, None) for each LLM token
+        """
+        # Embedding/FAISS work is blocking; the token stream below only waits on the network
+        source_docs = await asyncio.to_thread(self.retrieve, query, query_embedding)
+        yield None, self.format_sources(source_docs)
+        
+        payload = {
+            "model": LLM_MODEL,
+            "prompt": self.build_prompt(query, source_docs),
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE
+        }
+        # Ollama sends one JSON object per line as tokens are generated; the timeout is per read
+        async with OllamaService.generate_stream(OLLAMA_GENERATE_URL, payload, OLLAMA_GENERATE_TIMEOUT) as response:
+            if response.status_code != 200:
+                error_text = (await response.aread()).decode(errors="replace")
+                raise RuntimeError(f"Error from Ollama API: {error_text}")
             
-            return chain
-        except Exception as e:
-            logger.error(f"Error creating chain: {str(e)}")
-            raise
-
-    def generate_answer(self, query: str) -> Tuple[str, List[Dict[str, Any]]]:
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                line_data = orjson.loads(line)
+                if line_data.get("response"):
+                    yield line_data["response"], None
+                if line_data.get("done"):
+                    break
+    
+    async def generate_answer(self, query: str, query_embedding: Optional[List[float]] = None) -> Tuple[str, List[Dict[str, Any]]]:
         """
-        Generate an answer to the user's query using the LangChain RAG pipeline
+        Generate an answer to the user's query from the retrieved chunks with one Ollama call
         Args:
             query: The user's query
+            query_embedding: Precomputed query embedding (e.g. from QueryEmbeddingBatcher)
         Returns:
             Tuple containing the generated answer and the source chunks
         """
         try:
             start_time = time.time()
             
-            # Method 1: Using RetrievalQA chain
-            try:
-                chain = self.create_chain()
-                result = chain.invoke({"query": query})
-                answer = result.get("result", "")
-                source_docs = result.get("source_documents", [])
-                
-                # Format source documents
-                sources = []
-                for doc in source_docs:
-                    sources.append({
-                        "chapter_title": doc.metadata.get("chapter_title", ""),
-                        "article_title": doc.metadata.get("article_title", ""),
-                        "content": doc.page_content
-                    })
-                
-                logger.info(f"Generated answer using RetrievalQA chain in {time.time() - start_time:.2f} seconds")
-                return answer, sources
+            # Embedding/FAISS work is blocking; the LLM call below only waits on the network
+            source_docs = await asyncio.to_thread(self.retrieve, query, query_embedding)
+            if not source_docs:
+                return "Tôi không tìm thấy thông tin liên quan trong luật giao thông.", []
+            
+            # Call Ollama API directly over the shared pooled async client, in one of the
+            # completion slots (absolute URL, so OLLAMA_API_BASE wins over the client's base_url)
+            payload = {
+                "model": LLM_MODEL,
+                "prompt": self.build_prompt(query, source_docs),
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE
+            }
+            response = await OllamaService.generate(OLLAMA_GENERATE_URL, payload, OLLAMA_GENERATE_TIMEOUT)
+            
+            if response.status_code != 200:
+                logger.error(f"Error from Ollama API: {response.text}")
+                return "Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi của bạn.", []
+            
+            # Extract the generated text
+            answer = orjson.loads(response.content).get("response", "")
+            
+            logger.info(f"Generated answer in {time.time() - start_time:.2f} seconds")
+            return answer, self.format_sources(source_docs)
             
-            # Method 2: Fallback to manual approach if chain fails
-            except Exception as chain_error:
-                logger.warning(f"Chain failed, falling back to manual approach: {str(chain_error)}")
-                
-                # Search for relevant chunks
-                search_results = self.search(query)
-                
-                if not search_results:
-                    return "Tôi không tìm thấy thông tin liên quan trong luật giao thông.", []
-                
-                # Format context
-                context_str = self.format_context(search_results)
-                
-                # Format the complete prompt
-                prompt = PROMPT_TEMPLATE.format(context=context_str, question=query)
-                
-                # Create the Ollama API payload
-                payload = {
-                    "model": LLM_MODEL,
-                    "prompt": prompt,
-                    "stream": False
-                }
-                
-                # Call Ollama API
-                response = requests.post(OLLAMA_API_URL, json=payload)
-                
-                if response.status_code != 200:
-                    logger.error(f"Error from Ollama API: {response.text}")
-                    return "Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi của bạn.", []
-                
-                # Extract the generated text
-                answer = response.json().get("response", "")
-                
-                logger.info(f"Generated answer using manual approach in {time.time() - start_time:.2f} seconds")
-                return answer, search_results
-                
         except Exception as e:
             logger.error(f"Error generating answer: {str(e)}")
-            return "Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi của bạn.", []
\ No newline at end of file
+            return "Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi của bạn.", []
+
+def create_rag_processor() -> RAGProcessor:
+    """
+    Create a RAG processor with the embedding model and the saved vectorstore (if any) loaded.
+    Building a missing index is left to the /rag/build-index endpoint.
+    """
+    processor = RAGProcessor()
+    processor.initialize_embeddings()
+    processor.load_vectorstore()
+    return processor
+
+class QueryEmbeddingBatcher:
+    """
+    Coalesces concurrent query embeddings into a single RAGProcessor.embed_batch call.
+    Callers await embed(); a background task drains the queue every EMBED_MAX_WAIT_MS.
+    """
+    
+    def __init__(self, processor: RAGProcessor, max_batch: int = EMBED_MAX_BATCH, max_wait_ms: int = EMBED_MAX_WAIT_MS):
+        self.processor = processor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def embed(self, query: str) -> List[float]:
+        """Embed one query, sharing the forward pass with other in-flight queries"""
+        if self._task is None or self._task.done():
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                # Model inference is CPU/GPU bound; keep it off the event loop
+                vectors = await asyncio.to_thread(self.processor.embed_batch, [query for query, _ in batch])
+            except Exception as e:
+                logger.error(f"Error embedding query batch: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
@@ -0,0 +1,167 @@
+import os
+import pickle
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Any, Optional
+
+import faiss
+import numpy as np
+
+from app.services.rag_processor import FAISS_INDEX_PATH
+
+logger = logging.getLogger(__name__)
+
+# Configuration variables
+SEMANTIC_CACHE_PATH = os.getenv(
+    "SEMANTIC_CACHE_PATH",
+    os.path.join(os.path.dirname(FAISS_INDEX_PATH), "semantic_cache")
+)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+# Persist to disk after this many new entries
+SEMANTIC_CACHE_SAVE_EVERY = int(os.getenv("SEMANTIC_CACHE_SAVE_EVERY", "20"))
+
+class SemanticCache:
+    """
+    Cache of RAG answers keyed by query embedding.
+    A query whose cosine similarity to a cached query is above the threshold
+    gets the cached answer and sources instead of a new retrieval + LLM call.
+    Entries are evicted in LRU order and expire after a TTL.
+    """
+    
+    def __init__(self, path: str = SEMANTIC_CACHE_PATH, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Created on first add, once the embedding dimension is known
+        self.index: Optional[faiss.IndexIDMap2] = None
+        # entry id -> (answer, sources, created_at), oldest first
+        self.entries: "OrderedDict[int, Tuple[str, List[Dict[str, Any]], float]]" = OrderedDict()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self._unsaved = 0
+        # Lookups and inserts run in worker threads; the lock only guards in-memory state
+        self._lock = threading.Lock()
+        # Serializes disk writes (taken before _lock), so an older snapshot never overwrites a newer one
+        self._save_lock = threading.Lock()
+        self.load()
+    
+    @staticmethod
+    def _to_vector(embedding: List[float]) -> np.ndarray:
+        """Normalize so inner product equals cosine similarity"""
+        vector = np.array([embedding], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+    
+    def lookup(self, embedding: List[float]) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """Return (answer, sources) for a semantically equivalent cached query, or None"""
+        with self._lock:
+            if self.index is not None and self.index.ntotal > 0:
+                scores, ids = self.index.search(self._to_vector(embedding), 1)
+                entry_id = int(ids[0][0])
+                
+                if entry_id != -1 and scores[0][0] >= self.threshold:
+                    answer, sources, created_at = self.entries[entry_id]
+                    if time.time() - created_at <= self.ttl_seconds:
+                        self.entries.move_to_end(entry_id)
+                        self.hits += 1
+                        return answer, sources
+                    self._remove(entry_id)
+            
+            self.misses += 1
+            return None
+    
+    def add(self, embedding: List[float], answer: str, sources: List[Dict[str, Any]]):
+        """Cache the answer for a query embedding, evicting least recently used entries"""
+        with self._lock:
+            vector = self._to_vector(embedding)
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self.entries[entry_id] = (answer, sources, time.time())
+            
+            while len(self.entries) > self.max_entries:
+                oldest_id, _ = self.entries.popitem(last=False)
+                self.index.remove_ids(np.array([oldest_id], dtype=np.int64))
+            
+            self._unsaved += 1
+            should_save = self._unsaved >= SEMANTIC_CACHE_SAVE_EVERY
+        
+        # Written outside _lock, so lookups don't wait for the disk
+        if should_save:
+            self.save()
+    
+    def _remove(self, entry_id: int):
+        self.entries.pop(entry_id, None)
+        self.index.remove_ids(np.array([entry_id], dtype=np.int64))
+    
+    def clear(self):
+        """Drop every cached answer (e.g. after the document index is rebuilt), on disk too"""
+        with self._save_lock, self._lock:
+            self.index = None
+            self.entries = OrderedDict()
+            self.next_id = 0
+            self._unsaved = 0
+            for filename in ("index.faiss", "entries.pkl"):
+                try:
+                    os.remove(os.path.join(self.path, filename))
+                except FileNotFoundError:
+                    pass
+    
+    def stats(self) -> Dict[str, Any]:
+        """Cache size and hit rate for /rag/status"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "threshold": self.threshold,
+        }
+    
+    def save(self):
+        """Save the cache to disk: snapshot under the lock, write without it"""
+        with self._save_lock:
+            with self._lock:
+                if self.index is None:
+                    return
+                index_bytes = faiss.serialize_index(self.index)
+                snapshot = {"entries": OrderedDict(self.entries), "next_id": self.next_id}
+                self._unsaved = 0
+            
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                with open(os.path.join(self.path, "index.faiss"), "wb") as f:
+                    f.write(index_bytes.tobytes())
+                with open(os.path.join(self.path, "entries.pkl"), "wb") as f:
+                    pickle.dump(snapshot, f)
+            except Exception as e:
+                logger.error(f"Error saving semantic cache: {str(e)}")
+    
+    def load(self):
+        """Load the cache from disk if it was saved before"""
+        index_path = os.path.join(self.path, "index.faiss")
+        entries_path = os.path.join(self.path, "entries.pkl")
+        if not (os.path.exists(index_path) and os.path.exists(entries_path)):
+            return
+        try:
+            self.index = faiss.read_index(index_path)
+            with open(entries_path, "rb") as f:
+                data = pickle.load(f)
+            self.entries = data["entries"]
+            self.next_id = data["next_id"]
+            logger.info(f"Loaded semantic cache with {len(self.entries)} entries")
+        except Exception as e:
+            logger.error(f"Error loading semantic cache: {str(e)}")
+            self.index = None
+            self.entries = OrderedDict()
+            self.next_id = 0
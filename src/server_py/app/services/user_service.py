@@ -1,17 +1,23 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, select, update
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 from typing import Optional
 
 from app.models.models import User
-from app.core.security import verify_password, get_password_hash
+from app.core.security import verify_password_async, get_password_hash_async
 from app.schemas.user import UserProfileResponse, UpdateProfileRequest, ChangePasswordRequest
 from app.schemas.base import MessageResponse
 
 class UserService:
     @staticmethod
-    def get_user_profile(db: Session, username: str) -> UserProfileResponse:
+    async def get_user_profile(db: AsyncSession, username: str) -> UserProfileResponse:
         """Get user profile information"""
-        user = db.query(User).filter(User.username == username).first()
+        # Roles are joined into the same query instead of lazy-loaded afterwards
+        result = await db.execute(
+            select(User).options(joinedload(User.roles)).where(User.username == username)
+        )
+        user = result.unique().scalars().first()
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -33,9 +39,13 @@ class UserService:
         )
     
     @staticmethod
-    def update_profile(db: Session, username: str, update_data: UpdateProfileRequest) -> UserProfileResponse:
+    async def update_profile(db: AsyncSession, username: str, update_data: UpdateProfileRequest) -> UserProfileResponse:
         """Update user profile information"""
-        user = db.query(User).filter(User.username == username).first()
+        # Roles are joined into the same query instead of lazy-loaded afterwards
+        result = await db.execute(
+            select(User).options(joinedload(User.roles)).where(User.username == username)
+        )
+        user = result.unique().scalars().first()
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -51,16 +61,18 @@ class UserService:
             user.phone_number = update_data.phone_number
         if update_data.email is not None and update_data.email != user.email:
             # Check if email is already used by another user
-            existing_user = db.query(User).filter(User.email == update_data.email).first()
-            if existing_user and existing_user.id != user.id:
+            email_taken = await db.scalar(
+                select(exists().where(User.email == update_data.email, User.id != user.id))
+            )
+            if email_taken:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Email is already in use"
                 )
             user.email = update_data.email
         
-        db.commit()
-        db.refresh(user)
+        # updated_at comes back via RETURNING (eager_defaults), so no refresh is needed
+        await db.commit()
         
         # Return updated profile
         return UserProfileResponse(
@@ -77,46 +89,51 @@ class UserService:
         )
     
     @staticmethod
-    def change_password(db: Session, username: str, password_data: ChangePasswordRequest) -> MessageResponse:
+    async def change_password(db: AsyncSession, username: str, password_data: ChangePasswordRequest) -> MessageResponse:
         """Change user password"""
-        user = db.query(User).filter(User.username == username).first()
+        # Only the id and hash are needed, no User entity
+        result = await db.execute(select(User.id, User.password).where(User.username == username))
+        user = result.first()
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
         
-        # Verify current password
-        if not verify_password(password_data.current_password, user.password):
+        # Validate new password matches confirmation (cheap, so before the bcrypt check)
+        if password_data.new_password != password_data.confirm_password:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Current password is incorrect"
+                detail="New password and confirmation do not match"
             )
         
-        # Validate new password matches confirmation
-        if password_data.new_password != password_data.confirm_password:
+        # Verify current password
+        if not await verify_password_async(password_data.current_password, user.password):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="New password and confirmation do not match"
+                detail="Current password is incorrect"
             )
         
         # Update password
-        user.password = get_password_hash(password_data.new_password)
-        db.commit()
+        new_hash = await get_password_hash_async(password_data.new_password)
+        await db.execute(update(User).where(User.id == user.id).values(password=new_hash))
+        await db.commit()
         
         return MessageResponse(message="Password changed successfully", success=True)
     
     @staticmethod
-    def update_avatar(db: Session, username: str, avatar_url: str) -> MessageResponse:
+    async def update_avatar(db: AsyncSession, username: str, avatar_url: str) -> MessageResponse:
         """Update user avatar URL"""
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
+        # One UPDATE; RETURNING tells whether the user exists
+        user_id = await db.scalar(
+            update(User).where(User.username == username).values(avatar_url=avatar_url).returning(User.id)
+        )
+        if user_id is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
         
-        user.avatar_url = avatar_url
-        db.commit()
+        await db.commit()
         
         return MessageResponse(message="Avatar updated successfully", success=True)
\ No newline at end of file
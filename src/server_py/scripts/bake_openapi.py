@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""
+Generate the OpenAPI schema once (at release / image build) and write it to
+app/static/openapi.json. With OPENAPI_USE_BAKED=1 the API serves this file
+instead of walking the routes on startup.
+
+Usage (from src/server_py): python scripts/bake_openapi.py
+"""
+import os
+import sys
+
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.main import app, OPENAPI_BAKED_PATH
+
+def main():
+    schema = app.openapi()
+    os.makedirs(os.path.dirname(OPENAPI_BAKED_PATH), exist_ok=True)
+    with open(OPENAPI_BAKED_PATH, "wb") as f:
+        f.write(orjson.dumps(schema))
+    print(f"Wrote OpenAPI schema to {OPENAPI_BAKED_PATH}")
+
+if __name__ == "__main__":
+    main()
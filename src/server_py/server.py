@@ -47,11 +47,16 @@ def main():
     
     # Start the FastAPI application with Uvicorn
     logger.info("Starting PTIT Chat API server...")
+    # uvloop + httptools (uvicorn[standard]) cut per-frame overhead on SSE streams
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=8080,
-        reload=True,  # Enable auto-reload during development
+        loop="uvloop",
+        http="httptools",
+        workers=settings.UVICORN_WORKERS,
+        # Auto-reload during development; uvicorn runs a single process when it is on
+        reload=settings.UVICORN_RELOAD,
     )
 
 if __name__ == "__main__":